@@ -0,0 +1,277 @@
+"""
+Inference benchmarks for server.analysis
+Measures latency percentiles and throughput for single and batched sentiment scoring,
+sweeping batch size, torch thread count and text length over a fixed corpus.
+
+    python3 -m benchmarks.bench_analysis --mode stub
+    python3 -m benchmarks.bench_analysis --mode real --output bench.json
+
+The stub mode replaces the model with a numpy workload of similar shape, so it runs
+anywhere and checks the harness itself. Results are written as JSON so runs can be diffed.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from collections.abc import Callable
+from datetime import datetime
+
+import numpy as np
+
+SUBJECTS = [
+    "Markets",
+    "Lawmakers",
+    "Scientists",
+    "The central bank",
+    "Voters",
+    "Tech giants",
+    "Farmers",
+    "City officials",
+    "Investors",
+    "Doctors",
+]
+VERBS = [
+    "rally after",
+    "brace for",
+    "celebrate",
+    "warn of",
+    "push back against",
+    "struggle with",
+    "welcome",
+    "question",
+]
+OBJECTS = [
+    "surprise rate hike",
+    "record heat wave",
+    "new trade deal",
+    "sweeping budget cuts",
+    "breakthrough in battery research",
+    "wave of layoffs",
+    "long-awaited peace talks",
+    "rising grocery prices",
+]
+DETAILS = [
+    "as inflation cools",
+    "amid growing uncertainty",
+    "in a rare show of unity",
+    "despite strong objections",
+    "for the third straight week",
+    "ahead of the election",
+]
+
+# Approximate words per text for each length setting
+TEXT_LENGTHS = {"short": 6, "medium": 15, "long": 40}
+
+
+def make_corpus(size: int, words: int, seed: int = 0) -> list[str]:
+    """Fixed, headline-like strings of roughly the given number of words"""
+
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(size):
+        parts = [rng.choice(SUBJECTS), rng.choice(VERBS), rng.choice(OBJECTS)]
+        while len(" ".join(parts).split()) < words:
+            parts.append(rng.choice(DETAILS))
+        corpus.append(" ".join(" ".join(parts).split()[:words]))
+    return corpus
+
+
+##############################################################################
+# Predictors
+#
+
+
+class StubPredictor:
+    """
+    Stand-in for the model with a similar cost profile
+    Each batch does a matrix product over (texts x tokens) rows, so cost grows with both
+    batch size and text length, and numpy's thread pool plays the part of torch's.
+    """
+
+    def __init__(self, hidden: int = 256, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        self.weights = rng.standard_normal((hidden, hidden), dtype=np.float32)
+        self.hidden = hidden
+
+    def __call__(self, texts: list[str], batch_size: int) -> list[float]:
+        scores = []
+        for start in range(0, len(texts), batch_size):
+            batch = texts[start : start + batch_size]
+            tokens = max(len(text.split()) for text in batch) + 2
+            activations = np.ones((len(batch) * tokens, self.hidden), np.float32)
+            for _ in range(6):
+                activations = np.tanh(activations @ self.weights / self.hidden)
+            pooled = activations.reshape(len(batch), tokens, self.hidden)[:, 0]
+            scores.extend(float(np.tanh(row.sum())) for row in pooled)
+        return scores
+
+
+def make_predictor(mode: str) -> Callable[[list[str], int], list[float]]:
+    """Predictor for the chosen mode. Neither goes through the score cache"""
+
+    if mode == "stub":
+        return StubPredictor()
+
+    from server.analysis import get_backend, predict_scores_locally
+
+    get_backend()
+    return predict_scores_locally
+
+
+def set_threads(mode: str, threads: int):
+    """Limit the predictor's thread pool. Returns a context manager"""
+
+    from threadpoolctl import threadpool_limits
+
+    if mode == "real":
+        from server.analysis import configure_threads
+
+        configure_threads(threads)
+    return threadpool_limits(limits=threads)
+
+
+##############################################################################
+# Measurement
+#
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    """Nearest-rank percentile"""
+
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies: list[float], texts: int, elapsed: float) -> dict:
+    """Latency percentiles in milliseconds and throughput in texts per second"""
+
+    return {
+        "calls": len(latencies),
+        "texts": texts,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000,
+        "throughput": texts / elapsed if elapsed else 0.0,
+    }
+
+
+def measure(
+    predict: Callable[[list[str], int], list[float]],
+    corpus: list[str],
+    batch_size: int,
+    warmup: int,
+) -> dict:
+    """Time predict over the corpus in calls of batch_size texts"""
+
+    batches = [corpus[i : i + batch_size] for i in range(0, len(corpus), batch_size)]
+    for batch in batches[:warmup]:
+        predict(batch, batch_size)
+
+    latencies = []
+    started = time.perf_counter()
+    for batch in batches:
+        call_started = time.perf_counter()
+        predict(batch, batch_size)
+        latencies.append(time.perf_counter() - call_started)
+    elapsed = time.perf_counter() - started
+
+    return summarize(latencies, len(corpus), elapsed)
+
+
+def run(
+    mode: str,
+    batch_sizes: list[int],
+    threads: list[int],
+    lengths: list[str],
+    corpus_size: int,
+    warmup: int,
+) -> dict:
+    """Run the full sweep and return the JSON report"""
+
+    predict = make_predictor(mode)
+    results = []
+    for length in lengths:
+        corpus = make_corpus(corpus_size, TEXT_LENGTHS[length])
+        for thread_count in threads:
+            with set_threads(mode, thread_count):
+                # Batch size 1 is the single-inference case used by rewrites
+                for batch_size in batch_sizes:
+                    stats = measure(predict, corpus, batch_size, warmup)
+                    results.append(
+                        {
+                            "length": length,
+                            "threads": thread_count,
+                            "batch_size": batch_size,
+                            **stats,
+                        }
+                    )
+                    print(
+                        f"{length:>6} threads={thread_count:<2} batch={batch_size:<3} "
+                        f"p50={stats['p50_ms']:.1f}ms p99={stats['p99_ms']:.1f}ms "
+                        f"{stats['throughput']:.1f} texts/s",
+                        file=sys.stderr,
+                    )
+
+    return {"meta": metadata(mode, corpus_size), "results": results}
+
+
+def metadata(mode: str, corpus_size: int) -> dict:
+    """What the numbers were measured on"""
+
+    meta = {
+        "mode": mode,
+        "corpus_size": corpus_size,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+    if mode == "real":
+        from server.analysis import BACKEND, MODEL_VERSION
+
+        meta.update(backend=BACKEND, model_version=MODEL_VERSION)
+    return meta
+
+
+def int_list(value: str) -> list[int]:
+    return [int(item) for item in value.split(",")]
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark sentiment inference")
+    parser.add_argument("--mode", choices=["stub", "real"], default="stub")
+    parser.add_argument("--batch-sizes", type=int_list, default=[1, 8, 32, 64])
+    parser.add_argument("--threads", type=int_list, default=[1, 2, 4])
+    parser.add_argument(
+        "--lengths",
+        type=lambda value: value.split(","),
+        default=list(TEXT_LENGTHS),
+        help="Comma-separated subset of " + ",".join(TEXT_LENGTHS),
+    )
+    parser.add_argument("--corpus-size", type=int, default=256)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    report = run(
+        args.mode,
+        args.batch_sizes,
+        args.threads,
+        args.lengths,
+        args.corpus_size,
+        args.warmup,
+    )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
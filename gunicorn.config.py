@@ -1,7 +1,37 @@
-# import multiprocessing
+import multiprocessing
+import os
 
 bind = "0.0.0.0:5000"
 
-workers = 1  # multiprocessing.cpu_count() * 2 + 1
+workers = int(os.environ.get("GUNICORN_WORKERS", min(multiprocessing.cpu_count(), 4)))
 max_requests = 1000
 timout = 45
+
+# Load the app, and the sentiment model with it, once in the master process.
+# Forked workers then share the model weights copy-on-write instead of each loading a copy.
+preload_app = os.environ.get("PRELOAD_MODEL", "true").lower() == "true"
+
+
+def when_ready(server):
+    """Runs in the master after the app is loaded and before any workers are forked"""
+
+    if preload_app:
+        from server.analysis import preload
+        from server.semantic import BACKEND, get_word_vectors
+
+        if BACKEND == "word-vectors":
+            get_word_vectors()
+        preload()
+
+
+def post_fork(server, worker):
+    """Split the cores between the workers, so they do not oversubscribe them with torch threads"""
+
+    from server.analysis import INFERENCE_SOCKET, configure_threads
+
+    # With an inference service the workers never load the model
+    if INFERENCE_SOCKET:
+        return
+
+    threads = int(os.environ.get("TORCH_THREADS", 0))
+    configure_threads(threads or max(1, multiprocessing.cpu_count() // workers))
@@ -0,0 +1,34 @@
+"""Score rewrites asynchronously
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 14:42:15.208344
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Every existing rewrite was scored when it was submitted
+    op.add_column('rewrites', sa.Column('status', sa.String(length=10), nullable=False, server_default='complete'))
+    op.alter_column('rewrites', 'status', server_default=None)
+    op.alter_column('rewrites', 'sentiment_score', existing_type=sa.Float(), nullable=True)
+    op.alter_column('rewrites', 'sentiment_match', existing_type=sa.Float(), nullable=True)
+    op.alter_column('rewrites', 'semantic_match', existing_type=sa.Float(), nullable=True)
+
+
+def downgrade():
+    # Rewrites without scores cannot be kept once the scores are required
+    op.execute("DELETE FROM rewrites WHERE status != 'complete'")
+    op.alter_column('rewrites', 'semantic_match', existing_type=sa.Float(), nullable=False)
+    op.alter_column('rewrites', 'sentiment_match', existing_type=sa.Float(), nullable=False)
+    op.alter_column('rewrites', 'sentiment_score', existing_type=sa.Float(), nullable=False)
+    op.drop_column('rewrites', 'status')
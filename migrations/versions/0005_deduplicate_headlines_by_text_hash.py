@@ -0,0 +1,50 @@
+"""Deduplicate headlines by text hash
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 14:42:20.031775
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('headlines', sa.Column('text_hash', sa.String(length=64), nullable=True))
+    # The same sha256 of the UTF-8 text as server.analysis.text_hash
+    op.execute("UPDATE headlines SET text_hash = encode(sha256(convert_to(text, 'UTF8')), 'hex')")
+
+    # Keep the oldest copy of any headline a source has twice, moving its rewrites over
+    op.execute("""
+        CREATE TEMPORARY TABLE duplicate_headlines ON COMMIT DROP AS
+        SELECT id, first_value(id) OVER (
+            PARTITION BY source_id, text_hash ORDER BY date, id
+        ) AS keep_id
+        FROM headlines
+    """)
+    op.execute("""
+        UPDATE rewrites SET headline_id = duplicate_headlines.keep_id
+        FROM duplicate_headlines
+        WHERE rewrites.headline_id = duplicate_headlines.id
+        AND duplicate_headlines.id != duplicate_headlines.keep_id
+    """)
+    op.execute("""
+        DELETE FROM headlines USING duplicate_headlines
+        WHERE headlines.id = duplicate_headlines.id
+        AND duplicate_headlines.id != duplicate_headlines.keep_id
+    """)
+
+    op.alter_column('headlines', 'text_hash', existing_type=sa.String(length=64), nullable=False)
+    op.create_unique_constraint('headlines_source_id_text_hash_key', 'headlines', ['source_id', 'text_hash'])
+
+
+def downgrade():
+    op.drop_constraint('headlines_source_id_text_hash_key', 'headlines', type_='unique')
+    op.drop_column('headlines', 'text_hash')
@@ -2,10 +2,14 @@
 
 import os
 from flask import Flask
+from flask_migrate import Migrate
 from flask_sqlalchemy import SQLAlchemy
 
+MIGRATIONS = os.path.join(os.path.dirname(os.path.dirname(__file__)), "migrations")
+
 # Globally accessible libraries
 db = SQLAlchemy()
+migrate = Migrate()
 
 
 def create_app():
@@ -21,11 +25,11 @@ def create_app():
 
     # Initialize Plugins
     db.init_app(app)
+    migrate.init_app(app, db, directory=MIGRATIONS)
 
     with app.app_context():
         # Include our Routes
         from . import routes
 
-        db.create_all()
-
+        # The schema is created and upgraded by `flask db upgrade`, see migrations/
         return app
@@ -1,27 +1,306 @@
-"""Flair analysis"""
+"""Sentiment analysis"""
 
-from flair.models import TextClassifier
-from flair.data import Sentence
+import gc
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from collections.abc import Iterable
 
-classifier = TextClassifier.load("sentiment")
+import numpy as np
+
+from server.backends import SentimentBackend, backend_version, load_backend
+
+# Number of sentences sent through the model in a single forward pass
+BATCH_SIZE = int(os.environ.get("SENTIMENT_BATCH_SIZE", 32))
+
+# One of server.backends.BACKENDS. "flair" runs the model as downloaded;
+# "flair-quantized" converts its linear layers to int8, which is faster on CPU-only hosts
+# at a small cost in accuracy; "fake" is an instant word-counting stand-in for dev and tests
+BACKEND = os.environ.get("SENTIMENT_BACKEND", "flair")
+
+# Part of every cache key, so that changing the model never serves stale scores
+MODEL_VERSION = os.environ.get("SENTIMENT_MODEL_VERSION", backend_version(BACKEND))
+
+CACHE_SIZE = int(os.environ.get("SENTIMENT_CACHE_SIZE", 10000))
+
+# When set, scoring is done by the inference service (server.inference) on this socket
+INFERENCE_SOCKET = os.environ.get("INFERENCE_SOCKET")
+
+_backend: SentimentBackend | None = None
+_backend_lock = threading.Lock()
+
+# Thread budget from configure_threads, applied to the backend when it loads
+_threads: int | None = None
+
+_inference_client = None
+
+
+def get_backend() -> SentimentBackend:
+    """Import and load the configured backend the first time it is needed"""
+
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                backend = load_backend(BACKEND)
+                if _threads:
+                    backend.configure_threads(_threads)
+                _backend = backend
+    return _backend
+
+
+def configure_threads(threads: int | None = None) -> None:
+    """
+    Limit the threads the backend uses for each forward pass
+    Several gunicorn workers on the same cores would otherwise each start one thread per
+    core and fight over them. Defaults to TORCH_THREADS, if set. The budget is kept until
+    the backend loads, so calling this never loads the model by itself.
+    """
+
+    global _threads
+    threads = threads or int(os.environ.get("TORCH_THREADS", 0))
+    if not threads:
+        return
+
+    with _backend_lock:
+        _threads = threads
+        if _backend is not None:
+            _backend.configure_threads(threads)
+
+
+def preload() -> None:
+    """
+    Load the backend before the gunicorn master forks its workers
+    Every worker then shares the master's copy of the weights copy-on-write. gc.freeze
+    keeps the garbage collector from touching (and so copying) the pages afterwards.
+    """
+
+    if INFERENCE_SOCKET:
+        return
+
+    configure_threads()
+    get_backend()
+    gc.freeze()
+
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace so trivially different strings share a cache entry"""
+
+    return " ".join(text.split())
+
+
+def text_hash(text: str) -> str:
+    """Stable key for a piece of text"""
+
+    return hashlib.sha256(text.encode("utf8")).hexdigest()
+
+
+# A cached score, and the embedding from the same forward pass if one was kept
+CacheEntry = tuple[float, np.ndarray | None]
+
+
+class ScoreCache:
+    """
+    Two-tier cache of sentiment scores and their embeddings
+    The first tier is a bounded in-process LRU. The second tier is an optional shared store
+    (see server.models.SentimentCacheStore) with get_many and put_many methods, which lets
+    every worker reuse scores computed by any other. Texts scored without embeddings are
+    cached with None in their place, and only count as hits for callers that need scores.
+    """
+
+    def __init__(self, maxsize: int, store=None):
+        self.maxsize = maxsize
+        self.store = store
+        self.hits = 0
+        self.store_hits = 0
+        self.misses = 0
+        self._lru: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(
+        self, keys: list[str], embeddings: bool = False
+    ) -> dict[str, CacheEntry]:
+        """Look up text hashes in the LRU, then in the shared store"""
+
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._lru.get(key)
+                if entry and (not embeddings or entry[1] is not None):
+                    self._lru.move_to_end(key)
+                    found[key] = entry
+            self.hits += len(found)
+
+        missing = [key for key in keys if key not in found]
+        if missing and self.store:
+            stored = {
+                key: entry
+                for key, entry in self.store.get_many(missing, MODEL_VERSION).items()
+                if not embeddings or entry[1] is not None
+            }
+            self._remember(stored)
+            found.update(stored)
+            with self._lock:
+                self.store_hits += len(stored)
+
+        with self._lock:
+            self.misses += len(keys) - len(found)
+
+        return found
+
+    def put_many(self, entries: dict[str, CacheEntry]) -> None:
+        """Save newly computed scores, and embeddings if any, in both tiers"""
+
+        self._remember(entries)
+        if entries and self.store:
+            self.store.put_many(entries, MODEL_VERSION)
+
+    def _remember(self, entries: dict[str, CacheEntry]) -> None:
+        with self._lock:
+            for key, (score, embedding) in entries.items():
+                # Scoring a text again without its embedding keeps the one cached
+                if embedding is None and key in self._lru:
+                    embedding = self._lru[key][1]
+                self._lru[key] = (score, embedding)
+                self._lru.move_to_end(key)
+            while len(self._lru) > self.maxsize:
+                self._lru.popitem(last=False)
+
+    def stats(self) -> dict[str, int]:
+        """Hit/miss counters for this process"""
+
+        return {
+            "hits": self.hits,
+            "store_hits": self.store_hits,
+            "misses": self.misses,
+            "size": len(self._lru),
+        }
+
+    def clear(self) -> None:
+        """Empty the in-process tier and reset the counters"""
+
+        with self._lock:
+            self._lru.clear()
+            self.hits = self.store_hits = self.misses = 0
+
+
+score_cache = ScoreCache(CACHE_SIZE)
 
 
 def calc_sentiment_score(sentence: str) -> float:
     """Classify a sentence by sentiment"""
 
-    flair_sentence = Sentence(sentence)
+    return calc_sentiment_scores([sentence])[0]
+
+
+def calc_sentiment_scores(
+    texts: Iterable[str], batch_size: int | None = None
+) -> list[float]:
+    """
+    Classify many sentences by sentiment
+    Scores are looked up in score_cache first; only the texts that miss both tiers are
+    run through the model, in mini-batches of batch_size.
+    """
+
+    normalized = [normalize_text(text) for text in texts]
+    keys = [text_hash(text) for text in normalized]
+    scores = {
+        key: score for key, (score, _) in score_cache.get_many(unique(keys)).items()
+    }
+
+    uncached = {key: text for key, text in zip(keys, normalized) if key not in scores}
+    if uncached:
+        computed = dict(
+            zip(uncached, predict_scores(list(uncached.values()), batch_size))
+        )
+        score_cache.put_many({key: (score, None) for key, score in computed.items()})
+        scores.update(computed)
+
+    return [scores[key] for key in keys]
+
+
+def calc_sentiment_and_embeddings(
+    texts: Iterable[str], batch_size: int | None = None
+) -> tuple[list[float], list[np.ndarray]]:
+    """
+    Sentiment scores and sentence embeddings from the same forward pass
+    The embedding is the pooled DistilBERT output the classifier's decoder reads, so
+    semantic matching costs nothing beyond the sentiment pass. Both are cached, so only
+    texts missing either one are run through the model.
+    """
+
+    normalized = [normalize_text(text) for text in texts]
+    keys = [text_hash(text) for text in normalized]
+    entries = score_cache.get_many(unique(keys), embeddings=True)
+
+    uncached = {key: text for key, text in zip(keys, normalized) if key not in entries}
+    if uncached:
+        if INFERENCE_SOCKET:
+            scores, embeddings = inference_client().predict_with_embeddings(
+                list(uncached.values())
+            )
+            embeddings = [
+                np.asarray(embedding, dtype=np.float32) for embedding in embeddings
+            ]
+        else:
+            scores, embeddings = predict_with_embeddings_locally(
+                list(uncached.values()), batch_size
+            )
+        computed = dict(zip(uncached, zip(scores, embeddings)))
+        score_cache.put_many(computed)
+        entries.update(computed)
+
+    return [entries[key][0] for key in keys], [entries[key][1] for key in keys]
+
+
+def unique(keys: list[str]) -> list[str]:
+    """Keys without repeats, in order"""
+
+    return list(dict.fromkeys(keys))
+
+
+def inference_client():
+    """Client for the inference service on INFERENCE_SOCKET"""
+
+    global _inference_client
+    if _inference_client is None:
+        from server.inference import InferenceClient
+
+        _inference_client = InferenceClient(INFERENCE_SOCKET)
+    return _inference_client
+
+
+def predict_scores(texts: list[str], batch_size: int | None = None) -> list[float]:
+    """Score texts with the inference service if one is configured, or in this process"""
+
+    if INFERENCE_SOCKET:
+        return inference_client().predict_scores(texts)
+
+    return predict_scores_locally(texts, batch_size)
+
+
+def predict_scores_locally(
+    texts: list[str], batch_size: int | None = None
+) -> list[float]:
+    """
+    Run the backend over texts, bypassing the cache
+    Texts are split into mini-batches of batch_size, so a list of headlines costs a
+    handful of forward passes instead of one per headline.
+    """
+
+    if not texts:
+        return []
 
-    # classifier.predict has not return value. Sad!
-    classified_sentence = flair_sentence
-    classifier.predict(classified_sentence)
+    return get_backend().predict(texts, batch_size or BATCH_SIZE)
 
-    return sentence_score(classified_sentence)
 
+def predict_with_embeddings_locally(
+    texts: list[str], batch_size: int | None = None
+) -> tuple[list[float], list[np.ndarray]]:
+    """Run the backend over texts, keeping each sentence's embedding"""
 
-def sentence_score(sentence: Sentence) -> float:
-    """Extract Flair sentiment score"""
+    if not texts:
+        return [], []
 
-    if sentence.tag == "NEGATIVE":
-        return sentence.score * -1
-    else:
-        return sentence.score
+    return get_backend().predict_with_embeddings(texts, batch_size or BATCH_SIZE)
@@ -0,0 +1,57 @@
+"""
+Sentiment backends
+Each backend lives in its own module and is only imported once it is chosen, so a fast
+backend never pulls in torch or Flair.
+"""
+
+import importlib
+
+import numpy as np
+
+# name: (module:class, model version used in cache keys)
+BACKENDS = {
+    "flair": ("server.backends.flair:FlairBackend", "sentiment-en-mix-distillbert_4"),
+    "flair-quantized": (
+        "server.backends.flair:QuantizedFlairBackend",
+        "sentiment-en-mix-distillbert_4-int8",
+    ),
+    "fake": ("server.backends.lexicon:LexiconBackend", "lexicon-1"),
+}
+
+
+class SentimentBackend:
+    """Interface every backend implements"""
+
+    def predict(self, texts: list[str], batch_size: int) -> list[float]:
+        """Signed sentiment scores between -1 and 1"""
+
+        raise NotImplementedError
+
+    def predict_with_embeddings(
+        self, texts: list[str], batch_size: int
+    ) -> tuple[list[float], list[np.ndarray]]:
+        """Scores plus unit-length sentence embeddings from the same pass"""
+
+        raise NotImplementedError
+
+    def configure_threads(self, threads: int) -> None:
+        """Limit the threads used for each forward pass, if the backend has any"""
+
+
+def load_backend(name: str) -> SentimentBackend:
+    """Import and construct the named backend"""
+
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown sentiment backend: {name}")
+
+    module_name, class_name = BACKENDS[name][0].split(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+def backend_version(name: str) -> str:
+    """Model version of the named backend, without importing it"""
+
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown sentiment backend: {name}")
+
+    return BACKENDS[name][1]
@@ -0,0 +1,100 @@
+"""
+Deterministic lexicon backend
+Scores text by counting positive and negative words. It is nowhere near as good as the
+model, but it loads instantly, which makes it the right choice for development and tests.
+"""
+
+import hashlib
+import math
+import re
+
+import numpy as np
+
+from server.backends import SentimentBackend
+
+POSITIVE = {
+    "amazing": 2,
+    "award": 1,
+    "best": 2,
+    "breakthrough": 2,
+    "celebrate": 2,
+    "gain": 1,
+    "good": 2,
+    "great": 2,
+    "happy": 2,
+    "hope": 1,
+    "improve": 1,
+    "interesting": 1,
+    "love": 2,
+    "peace": 1,
+    "rally": 1,
+    "record": 1,
+    "rescue": 1,
+    "success": 2,
+    "win": 2,
+    "wins": 2,
+}
+
+NEGATIVE = {
+    "attack": 2,
+    "bad": 2,
+    "collapse": 2,
+    "crisis": 2,
+    "dead": 2,
+    "death": 2,
+    "fail": 2,
+    "fear": 2,
+    "fire": 1,
+    "kill": 2,
+    "killed": 2,
+    "loss": 1,
+    "plunge": 2,
+    "risk": 1,
+    "storm": 1,
+    "terrible": 2,
+    "tumble": 1,
+    "war": 2,
+    "warn": 1,
+    "worst": 2,
+}
+
+EMBEDDING_SIZE = 64
+
+WORD = re.compile(r"[a-z']+")
+
+
+class LexiconBackend(SentimentBackend):
+    """Word-counting stand-in for the model"""
+
+    def predict(self, texts: list[str], batch_size: int) -> list[float]:
+        return [lexicon_score(text) for text in texts]
+
+    def predict_with_embeddings(
+        self, texts: list[str], batch_size: int
+    ) -> tuple[list[float], list[np.ndarray]]:
+        return self.predict(texts, batch_size), [hashed_embedding(t) for t in texts]
+
+
+def lexicon_score(text: str) -> float:
+    """
+    Signed score shaped like Flair's: the sign is the label and the magnitude is a
+    confidence between 0.5 and 1
+    """
+
+    words = WORD.findall(text.lower())
+    total = sum(POSITIVE.get(word, 0) - NEGATIVE.get(word, 0) for word in words)
+    confidence = 0.5 + 0.5 * math.tanh(abs(total) / 2)
+
+    return -confidence if total < 0 else confidence
+
+
+def hashed_embedding(text: str) -> np.ndarray:
+    """Unit-length bag of hashed words"""
+
+    embedding = np.zeros(EMBEDDING_SIZE, dtype=np.float32)
+    for word in WORD.findall(text.lower()):
+        digest = hashlib.md5(word.encode("utf8")).digest()
+        embedding[int.from_bytes(digest[:4], "little") % EMBEDDING_SIZE] += 1
+    norm = np.linalg.norm(embedding)
+
+    return embedding / norm if norm else embedding
@@ -1,5 +1,5 @@
 #!/usr/bin/env bash
 
 set -e
-#flask db upgrade
+flask db upgrade
 gunicorn -c gunicorn.config.py wsgi:app
@@ -1,55 +1,609 @@
+import hashlib
+import logging
+import os
+import queue
 import requests
+import threading
 import xml.etree.ElementTree as ET
-from datetime import datetime
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from email.utils import parsedate_to_datetime
+from itertools import islice
+from tempfile import SpooledTemporaryFile
+from time import perf_counter
+from typing import Any, BinaryIO
 
-from server.models import new_headline, Headline, safe_commit
+from flask import Flask, current_app
+from requests.adapters import HTTPAdapter
+from sqlalchemy import or_
+from urllib3.util.retry import Retry
 
+from server.models import (
+    db,
+    Feed,
+    IngestRun,
+    find_new_items,
+    headline_rows,
+    safe_commit,
+    write_headlines,
+)
+from server.semantic import score_and_embed
 
-def get_nytimes_and_wsj_headlines():
-    nytimes = "https://rss.nytimes.com/services/xml/rss/nyt/HomePage.xml"
-    wsj_markets = "https://feeds.a.dj.com/rss/RSSMarketsMain.xml"
-    wsj_world = "https://feeds.a.dj.com/rss/RSSWorldNews.xml"
-    return [parse_rss_feed(feed) for feed in (nytimes, wsj_markets, wsj_world)]
+logger = logging.getLogger(__name__)
 
+# Feeds fetched at once, which is also the size of the connection pool
+FETCH_THREADS = int(os.environ.get("FEED_FETCH_THREADS", 8))
 
-def parse_rss_feed(source: str) -> list:
+# Seconds to wait for a connection, and then for each read, before giving up on a feed
+CONNECT_TIMEOUT = float(os.environ.get("FEED_CONNECT_TIMEOUT", 5))
+READ_TIMEOUT = float(os.environ.get("FEED_READ_TIMEOUT", 15))
+
+FETCH_RETRIES = int(os.environ.get("FEED_FETCH_RETRIES", 2))
+
+# Feed bodies larger than this are spooled to disk while they download
+SPOOL_SIZE = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+# Bounds in seconds for each feed's poll interval, which adapts to how busy the feed is
+MIN_POLL_INTERVAL = int(os.environ.get("FEED_MIN_POLL_INTERVAL", 15 * 60))
+MAX_POLL_INTERVAL = int(os.environ.get("FEED_MAX_POLL_INTERVAL", 12 * 60 * 60))
+DEFAULT_POLL_INTERVAL = 3 * 60 * 60
+
+# Items scored and inserted together
+INSERT_BATCH_SIZE = int(os.environ.get("INGEST_BATCH_SIZE", 500))
+
+
+##############################################################################
+# Fetching
+#
+
+
+def make_session() -> requests.Session:
+    """HTTP session with a keep-alive connection pool and bounded retries"""
+
+    retry = Retry(
+        total=FETCH_RETRIES,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=["GET"],
+    )
+    adapter = HTTPAdapter(
+        pool_connections=FETCH_THREADS, pool_maxsize=FETCH_THREADS, max_retries=retry
+    )
+
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+session = make_session()
+
+
+def fetch_feed(url: str, validators: dict | None = None) -> dict | None:
+    """
+    Download a single feed, or return None if that fails
+    Sends a conditional request when there are validators from the last poll. If the
+    feed has not changed, the result's body is None and nothing needs parsing.
+    """
+
+    validators = validators or {}
+    headers = {}
+    if validators.get("etag"):
+        headers["If-None-Match"] = validators["etag"]
+    if validators.get("last_modified"):
+        headers["If-Modified-Since"] = validators["last_modified"]
+
+    # The body is streamed to a spooled file while it is hashed, so a large feed is
+    # never held in memory whole
+    body = SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    digest = hashlib.sha256()
+    try:
+        with session.get(
+            url,
+            headers=headers,
+            timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+            stream=True,
+        ) as res:
+            res.raise_for_status()
+            if res.status_code == 304:
+                body.close()
+                return {**validators, "body": None}
+
+            for chunk in res.iter_content(CHUNK_SIZE):
+                digest.update(chunk)
+                body.write(chunk)
+    except requests.RequestException as e:
+        logger.warning("Could not fetch %s: %s", url, e)
+        body.close()
+        return None
+
+    content_hash = digest.hexdigest()
+    if content_hash == validators.get("content_hash"):
+        # Same body as last time, even though the server did not say so
+        body.close()
+        body = None
+    else:
+        body.seek(0)
+
+    return {
+        "etag": res.headers.get("ETag"),
+        "last_modified": res.headers.get("Last-Modified"),
+        "content_hash": content_hash,
+        "body": body,
+    }
+
+
+##############################################################################
+# Parsing
+#
+
+# Elements holding one entry, and where each field can be found, for RSS 2.0, Atom and
+# news sitemaps. Tags are compared without their namespace.
+ITEM_TAGS = {"item", "entry"}
+SITEMAP_ITEM_TAG = ("urlset", "url")
+TITLE_TAGS = ("title",)
+LINK_TAGS = ("link", "loc")
+DATE_TAGS = ("pubDate", "published", "updated", "publication_date", "date")
+
+
+def iter_feed_items(source: BinaryIO) -> Iterator[dict]:
+    """
+    Extract needed info from rss, atom or sitemap feeds, one item at a time
+    The document is parsed incrementally and every item is discarded once it has been
+    read, so memory stays flat however many items a feed has. A malformed or truncated
+    feed raises ET.ParseError once the items before the fault have been yielded, so the
+    ingest pipeline records it against the feed.
+    """
+
+    parents = []
+    for event, element in ET.iterparse(source, events=("start", "end")):
+        if event == "start":
+            parents.append(element)
+            continue
+
+        parents.pop()
+        if not is_item(element, parents[-1] if parents else None):
+            continue
+
+        item = parse_item(element)
+        element.clear()
+        if parents:
+            parents[-1].remove(element)
+        if item["text"]:
+            yield item
+
+
+def is_item(element: ET.Element, parent: ET.Element | None) -> bool:
+    """Whether element is a single entry of its feed"""
+
+    name = local_name(element.tag)
+    if name in ITEM_TAGS:
+        return True
+
+    # RSS also uses <url>, for the channel's image
+    return parent is not None and (local_name(parent.tag), name) == SITEMAP_ITEM_TAG
+
+
+def parse_item(element: ET.Element) -> dict:
+    """Read the title, link and date of a single item"""
+
+    fields = {}
+    for child in element.iter():
+        name = local_name(child.tag)
+        if name in fields:
+            continue
+        if name in TITLE_TAGS or name in DATE_TAGS:
+            fields[name] = (child.text or "").strip()
+        elif name in LINK_TAGS:
+            # Atom puts the url in href, and may list several links
+            if child.get("rel", "alternate") == "alternate":
+                fields[name] = (child.get("href") or child.text or "").strip()
+
+    return {
+        "text": fields.get("title"),
+        "url": next((fields[tag] for tag in LINK_TAGS if fields.get(tag)), ""),
+        "date": parse_date(
+            next((fields[tag] for tag in DATE_TAGS if fields.get(tag)), None)
+        ),
+    }
+
+
+def local_name(tag: str) -> str:
+    """Tag without its {namespace}"""
+
+    return tag.rsplit("}", 1)[-1]
+
+
+def parse_date(datestring: str | None) -> datetime | None:
+    """Parse RFC 822 dates (RSS) and ISO 8601 dates (Atom, sitemaps)"""
+
+    if not datestring:
+        return None
+
+    try:
+        return parsedate_to_datetime(datestring)
+    except (TypeError, ValueError):
+        pass
+
+    # Python 3.10's fromisoformat does not accept the Z suffix Atom feeds use for UTC
+    if datestring.endswith(("Z", "z")):
+        datestring = datestring[:-1] + "+00:00"
+
+    try:
+        return datetime.fromisoformat(datestring)
+    except ValueError:
+        return None
+
+
+##############################################################################
+# Polling
+#
+
+# Parsers by Feed.parser. iter_feed_items understands RSS, Atom and news sitemaps.
+PARSERS: dict[str, Callable[[BinaryIO], Iterator[dict]]] = {
+    "rss": iter_feed_items,
+}
+
+
+def poll_due_feeds(now: datetime | None = None) -> IngestRun | None:
+    """Poll every feed whose next poll is due"""
+
+    now = now or datetime.now()
+    feeds = Feed.query.filter(
+        or_(Feed.next_poll_at.is_(None), Feed.next_poll_at <= now)
+    ).all()
+    return poll_feeds(feeds, now)
+
+
+def poll_feeds(feeds: list[Feed], now: datetime | None = None) -> IngestRun | None:
     """
-    Extract needed info from rss feeds
-    This should work for most rss feeds, although the pubdate format might differ for some sources
+    Run feeds through the ingest pipeline, then schedule each one's next poll
+    Returns the run's entry in the ingest_runs ledger, or None if there were no feeds,
+    which leaves the ledger alone.
     """
-    res = requests.get(source)
-    root = ET.fromstring(res.text)
-    items = root.findall("./channel/item")
-    data = [
+
+    if not feeds:
+        return None
+
+    now = now or datetime.now()
+    jobs = [
         {
-            "text": i.find("title").text,
-            "url": i.find("link").text,
-            "date": parse_nytimes_date(i.find("pubDate").text),
+            "url": feed.url,
+            "source_id": feed.source_id,
+            "parser": feed.parser,
+            "validators": feed.validators(),
+            "result": None,
+            "fetched": 0,
+            "duplicates": 0,
+            "new": 0,
+            "seconds": {},
+            "errors": [],
         }
-        for i in items
+        for feed in feeds
     ]
-    return data
+    stats = run_pipeline(
+        ingest_stages(len(jobs)),
+        [(job, None) for job in jobs],
+        current_app._get_current_object(),
+    )
 
+    for feed, job in zip(feeds, jobs):
+        # Only remember what was seen once all its headlines are stored
+        if job["result"] and not job["errors"]:
+            feed.etag = job["result"]["etag"]
+            feed.last_modified = job["result"]["last_modified"]
+            feed.content_hash = job["result"]["content_hash"]
+            feed.checked_at = now
+        schedule_next_poll(feed, job["new"], now)
 
-def parse_nytimes_date(datestring: str | None) -> datetime | None:
-    if datestring:
-        return datetime.strptime(datestring, "%a, %d %b %Y %H:%M:%S %z")
-    else:
-        return None
+    run = ingest_run(now, jobs, stats)
+    safe_commit(run)
+
+    for name, stage in stats.items():
+        logger.info(
+            "%s: %d in %.2fs (%.1f/s), %d errors",
+            name,
+            stage["items"],
+            stage["seconds"],
+            stage["per_second"],
+            stage["errors"],
+        )
+
+    return run
 
 
-def send_to_database(source):
-    if source.name == "New York Times":
-        data = parse_rss_feed(
-            "https://rss.nytimes.com/services/xml/rss/nyt/HomePage.xml"
+def ingest_run(started_at: datetime, jobs: list[dict], stats: dict) -> IngestRun:
+    """Ledger entry for a finished run of poll_feeds"""
+
+    return IngestRun(
+        started_at=started_at,
+        finished_at=datetime.now(),
+        feeds=len(jobs),
+        fetched=sum(job["fetched"] for job in jobs),
+        duplicates=sum(job["duplicates"] for job in jobs),
+        new=sum(job["new"] for job in jobs),
+        errors=sum(len(job["errors"]) for job in jobs),
+        fetch_seconds=stats["fetch"]["seconds"],
+        parse_seconds=stats["parse"]["seconds"],
+        dedup_seconds=stats["dedup"]["seconds"],
+        score_seconds=stats["score"]["seconds"],
+        write_seconds=stats["write"]["seconds"],
+        feed_stats=[
+            {
+                "url": job["url"],
+                "changed": bool(job["result"] and job["result"].get("changed")),
+                **{
+                    key: job[key]
+                    for key in ("fetched", "duplicates", "new", "seconds", "errors")
+                },
+            }
+            for job in jobs
+        ],
+    )
+
+
+def ingest_stages(feeds: int) -> list["Stage"]:
+    """fetch -> parse -> dedup -> score -> write, for jobs made by poll_feeds"""
+
+    return [
+        Stage("fetch", fetch_stage, threads=max(1, min(feeds, FETCH_THREADS))),
+        Stage("parse", parse_stage, threads=PARSE_THREADS),
+        Stage("dedup", dedup_stage, size=len),
+        # Small batches from several feeds are scored together
+        Stage(
+            "score",
+            score_stage,
+            threads=SCORE_THREADS,
+            size=len,
+            batch=True,
+            gather=QUEUE_SIZE,
+        ),
+        Stage("write", write_stage, size=len),
+    ]
+
+
+def fetch_stage(job: dict, _) -> Iterator[tuple[dict, BinaryIO]]:
+    result = fetch_feed(job["url"], job["validators"])
+    if result is None:
+        raise ConnectionError(f"Could not fetch {job['url']}")
+
+    job["result"] = {key: value for key, value in result.items() if key != "body"}
+    job["result"]["changed"] = result["body"] is not None
+    # Unchanged feeds stop here, before any parsing, queries or scoring
+    if result["body"]:
+        yield job, result["body"]
+
+
+def parse_stage(job: dict, body: BinaryIO) -> Iterator[tuple[dict, list[dict]]]:
+    with body:
+        parse = PARSERS.get(job["parser"])
+        if parse is None:
+            raise ValueError(f"Unknown parser {job['parser']!r}")
+
+        for batch in batched(parse(body), INSERT_BATCH_SIZE):
+            count(job, "fetched", len(batch))
+            yield job, batch
+
+
+def dedup_stage(job: dict, batch: list[dict]) -> Iterator[tuple[dict, dict]]:
+    with rollback_on_error():
+        new_items = find_new_items(batch, job["source_id"])
+    count(job, "duplicates", len(batch) - len(new_items))
+    if new_items:
+        yield job, new_items
+
+
+def score_stage(batches: list[tuple[dict, dict]]) -> Iterator[tuple[dict, list]]:
+    texts = [item["text"] for _, items in batches for item in items.values()]
+    scores, embeddings = score_and_embed(texts)
+
+    start = 0
+    for job, items in batches:
+        end = start + len(items)
+        yield job, headline_rows(
+            items, job["source_id"], scores[start:end], embeddings[start:end]
         )
-    elif source.name == "Wall Street Journal":
-        data = parse_rss_feed(
-            "https://feeds.a.dj.com/rss/RSSMarketsMain.xml"
-        ) + parse_rss_feed("https://feeds.a.dj.com/rss/RSSWorldNews.xml")
-    else:
-        return
-    for item in data:
-        match = Headline.query.filter(Headline.text == item["text"]).first()
-        if not match:
-            safe_commit(new_headline(**item, source_id=source.id))
+        start = end
+
+
+def write_stage(job: dict, rows: list[dict]) -> Iterator:
+    with rollback_on_error():
+        added = write_headlines(rows)
+        db.session.commit()
+    count(job, "new", added)
+    return iter(())
+
+
+@contextmanager
+def rollback_on_error() -> Iterator[None]:
+    """
+    Roll back the thread's session if the block fails
+    Each stage thread keeps its session for the whole run, so a failed statement would
+    otherwise leave its transaction aborted and fail every later batch on that thread.
+    """
+
+    try:
+        yield
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+_count_lock = threading.Lock()
+
+
+def count(job: dict, key: str, n: int | float) -> None:
+    """Add to one of a job's counters, which several stages' threads update"""
+
+    with _count_lock:
+        job[key] = job.get(key, 0) + n
+
+
+def schedule_next_poll(feed: Feed, new: int, now: datetime) -> None:
+    """
+    Adapt the feed's poll interval to how often it has new items
+    A poll that finds new headlines halves the interval and one that finds none grows it
+    by half, within MIN_POLL_INTERVAL and MAX_POLL_INTERVAL. Busy feeds are polled
+    quickly and quiet ones back off until they cost a fetch or two a day.
+    """
+
+    interval = feed.poll_interval or DEFAULT_POLL_INTERVAL
+    interval = interval / 2 if new else interval * 1.5
+    feed.poll_interval = int(min(max(interval, MIN_POLL_INTERVAL), MAX_POLL_INTERVAL))
+    feed.next_poll_at = now + timedelta(seconds=feed.poll_interval)
+
+
+def batched(items: Iterable, size: int) -> Iterator[list]:
+    """Group an iterable into lists of at most size items"""
+
+    iterator = iter(items)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+##############################################################################
+# Pipeline
+#
+
+# Items waiting between two stages. Each item is at most INSERT_BATCH_SIZE headlines or
+# one feed body, so this bounds the memory a run can use.
+QUEUE_SIZE = int(os.environ.get("INGEST_QUEUE_SIZE", 4))
+
+PARSE_THREADS = int(os.environ.get("INGEST_PARSE_THREADS", 2))
+
+# More than one only helps when an inference service batches their requests together
+SCORE_THREADS = int(os.environ.get("INGEST_SCORE_THREADS", 1))
+
+# Passed along a queue once the stage feeding it has finished
+_DONE = object()
+
+
+class Stage:
+    """
+    One step of a pipeline, run by its own threads
+    work takes a (job, payload) item from the previous stage's queue and yields items for
+    the next. A batch stage is instead passed a list of up to gather items, taking what
+    is waiting rather than waiting for more. size counts the units in a payload, so
+    throughput can be reported in headlines rather than batches.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        work: Callable,
+        threads: int = 1,
+        size: Callable[[Any], int] | None = None,
+        batch: bool = False,
+        gather: int = 1,
+    ):
+        self.name = name
+        self.work = work
+        self.threads = threads
+        self.size = size or (lambda payload: 1)
+        self.batch = batch
+        self.gather = gather if batch else 1
+        self.items = 0
+        self.seconds = 0.0
+        self.errors = 0
+        self._running = threads
+        self._lock = threading.Lock()
+
+    def run(self, app: Flask, inbox: queue.Queue, outbox: queue.Queue | None) -> None:
+        """Work through the inbox until the previous stage is done"""
+
+        with app.app_context():
+            done = False
+            while not done:
+                items = [inbox.get()]
+                while len(items) < self.gather and items[-1] is not _DONE:
+                    try:
+                        items.append(inbox.get_nowait())
+                    except queue.Empty:
+                        break
+
+                if items[-1] is _DONE:
+                    # Leave it for the stage's other threads
+                    inbox.put(_DONE)
+                    items.pop()
+                    done = True
+                if items:
+                    self.process(items, outbox)
+
+        with self._lock:
+            self._running -= 1
+            if self._running == 0 and outbox is not None:
+                outbox.put(_DONE)
+
+    def process(self, items: list[tuple], outbox: queue.Queue | None) -> None:
+        """Run work over items, timing it but not the wait for room in the outbox"""
+
+        seconds = 0.0
+        try:
+            start = perf_counter()
+            outputs = iter(self.work(items) if self.batch else self.work(*items[0]))
+            for output in outputs:
+                seconds += perf_counter() - start
+                if outbox is not None:
+                    outbox.put(output)
+                start = perf_counter()
+            seconds += perf_counter() - start
+            errors = 0
+        except Exception as e:
+            seconds += perf_counter() - start
+            logger.warning("%s failed: %r", self.name, e)
+            for job, _ in items:
+                job["errors"].append(f"{self.name}: {e!r}")
+            errors = 1
+
+        # Jobs handled together share the time in proportion to their size
+        sizes = [self.size(payload) for _, payload in items]
+        for (job, _), size in zip(items, sizes):
+            share = seconds * size / sum(sizes) if sum(sizes) else seconds / len(items)
+            count(job.setdefault("seconds", {}), self.name, share)
+
+        with self._lock:
+            self.items += sum(sizes)
+            self.seconds += seconds
+            self.errors += errors
+
+    def stats(self) -> dict:
+        return {
+            "items": self.items,
+            "seconds": self.seconds,
+            "per_second": self.items / self.seconds if self.seconds else 0.0,
+            "errors": self.errors,
+        }
+
+
+def run_pipeline(stages: list[Stage], items: Iterable, app: Flask) -> dict[str, dict]:
+    """
+    Push items through stages connected by bounded queues, and return each stage's stats
+    Every stage runs at the same time in its own threads, each with an app context, so
+    slow downloads, inference and database writes overlap. A full queue makes the stage
+    before it wait.
+    """
+
+    queues = [queue.Queue(maxsize=QUEUE_SIZE) for _ in stages]
+    threads = [
+        threading.Thread(
+            target=stage.run,
+            args=(app, queues[i], queues[i + 1] if i + 1 < len(stages) else None),
+            name=f"ingest-{stage.name}",
+            daemon=True,
+        )
+        for i, stage in enumerate(stages)
+        for _ in range(stage.threads)
+    ]
+    for thread in threads:
+        thread.start()
+
+    for item in items:
+        queues[0].put(item)
+    queues[0].put(_DONE)
+
+    for thread in threads:
+        thread.join()
+
+    return {stage.name: stage.stats() for stage in stages}
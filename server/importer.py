@@ -0,0 +1,267 @@
+"""
+Bulk import of historical headlines
+Streams a JSONL or CSV archive of rows with source, text, url and date fields, scores the
+headlines the database does not have yet across a pool of processes, and inserts them in
+bulk. Rows without a valid date are skipped and counted, since headlines are dated today
+when they have none, which would mix old ones in with the news. Rows without text or a
+source are skipped and counted as invalid. After each chunk is written the number of
+rows done is saved to a checkpoint file, so an interrupted import picks up where it
+stopped instead of rescoring everything.
+
+Run with: python3 -m server.importer headlines.jsonl
+"""
+
+import argparse
+import csv
+import json
+import logging
+import multiprocessing
+import os
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import islice
+from time import perf_counter
+from uuid import UUID
+
+import numpy as np
+
+from server import create_app, db
+from server.feeds import batched, parse_date
+from server.models import Source, find_new_items, headline_rows, write_headlines
+
+logger = logging.getLogger(__name__)
+
+# Rows read, scored and inserted together
+CHUNK_SIZE = int(os.environ.get("IMPORT_CHUNK_SIZE", 1000))
+
+
+##############################################################################
+# Reading
+#
+
+
+def read_rows(path: str, format: str | None = None) -> Iterator[dict]:
+    """Stream rows from a JSONL or CSV file, chosen by format or the file extension"""
+
+    format = format or ("csv" if path.endswith(".csv") else "jsonl")
+    with open(path, newline="", encoding="utf8") as file:
+        if format == "csv":
+            yield from csv.DictReader(file)
+        else:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def to_item(row: dict) -> dict:
+    """Convert an archive row to the item format used by the feeds"""
+
+    day = row.get("date")
+    if isinstance(day, str):
+        day = parse_date(day)
+    return {
+        "text": (row.get("text") or "").strip(),
+        "url": row.get("url") or "",
+        "date": day or None,
+    }
+
+
+##############################################################################
+# Checkpoints
+#
+
+
+def read_checkpoint(path: str) -> int:
+    """Rows of the archive already imported, or 0 when starting afresh"""
+
+    try:
+        with open(path) as file:
+            return json.load(file)["rows"]
+    except FileNotFoundError:
+        return 0
+
+
+def write_checkpoint(path: str, rows: int) -> None:
+    """Save progress atomically, so a crash never leaves a half-written checkpoint"""
+
+    temporary = f"{path}.tmp"
+    with open(temporary, "w") as file:
+        json.dump({"rows": rows}, file)
+    os.replace(temporary, path)
+
+
+##############################################################################
+# Scoring
+#
+
+
+def init_worker() -> None:
+    """Load the model once per process, with one thread each so they share the cores"""
+
+    from server.analysis import INFERENCE_SOCKET, configure_threads, get_backend
+
+    # With an inference service the workers only send it texts, so need no model
+    if not INFERENCE_SOCKET:
+        configure_threads(1)
+        get_backend()
+
+
+def score_texts(texts: list[str]) -> tuple[list[float], list[np.ndarray | None]]:
+    """Score and embed texts in a worker process"""
+
+    from server.semantic import score_and_embed
+
+    return score_and_embed(texts)
+
+
+##############################################################################
+# Import
+#
+
+
+def import_headlines(
+    path: str,
+    format: str | None = None,
+    checkpoint: str | None = None,
+    workers: int | None = None,
+    chunk_size: int = CHUNK_SIZE,
+) -> dict:
+    """
+    Import an archive, resuming from its checkpoint, and return counts of what was done
+    Chunks are deduplicated against the database before they are sent to the pool, and
+    written in the order they were read, so the checkpoint only ever counts rows that
+    are safely stored.
+    """
+
+    checkpoint = checkpoint or f"{path}.checkpoint"
+    workers = workers or os.cpu_count() or 1
+    done = read_checkpoint(checkpoint)
+    stats = {
+        "rows": done,
+        "new": 0,
+        "duplicates": 0,
+        "undated": 0,
+        "invalid": 0,
+        "skipped": done,
+    }
+    sources: dict[str, UUID] = {}
+    start = perf_counter()
+
+    rows = islice(read_rows(path, format), done, None)
+    # Fresh processes, so they inherit no database connections
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(workers, context, initializer=init_worker) as pool:
+        pending: deque[tuple[int, dict[UUID, dict], Future]] = deque()
+        for chunk in batched(rows, chunk_size):
+            by_source, dropped = new_items_by_source(chunk, sources)
+            for reason, count in dropped.items():
+                stats[reason] += count
+            stats["duplicates"] += (
+                len(chunk) - sum(dropped.values()) - sum(map(len, by_source.values()))
+            )
+            texts = [
+                item["text"] for items in by_source.values() for item in items.values()
+            ]
+            done += len(chunk)
+            pending.append((done, by_source, pool.submit(score_texts, texts)))
+
+            # Keep every worker busy, but only a couple of chunks ahead of the writes
+            while len(pending) > 2 * workers:
+                stats["new"] += write_chunk(*pending.popleft(), checkpoint)
+
+        while pending:
+            stats["new"] += write_chunk(*pending.popleft(), checkpoint)
+
+    stats["rows"] = done
+    stats["seconds"] = perf_counter() - start
+    return stats
+
+
+def new_items_by_source(
+    chunk: list[dict], sources: dict[str, UUID]
+) -> tuple[dict[UUID, dict[str, dict]], dict[str, int]]:
+    """
+    Items of a chunk that are not in the database yet, grouped by source id, and the
+    number of rows dropped as invalid (no text or source) or undated (no valid date)
+    """
+
+    items: dict[UUID, list[dict]] = {}
+    dropped = {"invalid": 0, "undated": 0}
+    for row in chunk:
+        item = to_item(row)
+        if not item["text"] or not row.get("source"):
+            dropped["invalid"] += 1
+            continue
+        if not item["date"]:
+            dropped["undated"] += 1
+            continue
+        items.setdefault(source_id(row["source"], sources), []).append(item)
+
+    new_items = {source: find_new_items(rows, source) for source, rows in items.items()}
+    return new_items, dropped
+
+
+def source_id(name: str, sources: dict[str, UUID]) -> UUID:
+    """Id of the source with this name, adding it if the archive is the first to use it"""
+
+    if name not in sources:
+        source = Source.query.filter(Source.name == name).first()
+        if source is None:
+            logger.info("Adding source %s", name)
+            source = Source(name=name)
+            db.session.add(source)
+            db.session.commit()
+        sources[name] = source.id
+
+    return sources[name]
+
+
+def write_chunk(
+    done: int, by_source: dict[UUID, dict[str, dict]], future: Future, checkpoint: str
+) -> int:
+    """Insert a scored chunk, then record that the archive is done up to its last row"""
+
+    scores, embeddings = future.result()
+    added = 0
+    start = 0
+    for source, items in by_source.items():
+        end = start + len(items)
+        added += write_headlines(
+            headline_rows(items, source, scores[start:end], embeddings[start:end])
+        )
+        start = end
+    db.session.commit()
+
+    write_checkpoint(checkpoint, done)
+    logger.info("Imported %d rows, %d new", done, added)
+    return added
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Import an archive of headlines")
+    parser.add_argument("path", help="JSONL or CSV file with source, text, url, date")
+    parser.add_argument("--format", choices=["jsonl", "csv"])
+    parser.add_argument(
+        "--checkpoint", help="Progress file, by default the archive path + .checkpoint"
+    )
+    parser.add_argument(
+        "--restart", action="store_true", help="Ignore the checkpoint and start over"
+    )
+    parser.add_argument("--workers", type=int, help="Scoring processes, default cores")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s"
+    )
+    checkpoint = args.checkpoint or f"{args.path}.checkpoint"
+    if args.restart and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+
+    with create_app().app_context():
+        stats = import_headlines(
+            args.path, args.format, checkpoint, args.workers, args.chunk_size
+        )
+    print(json.dumps(stats))
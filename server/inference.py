@@ -0,0 +1,292 @@
+"""
+Sentiment inference service
+Owns the only copy of the model on a host and answers scoring requests over a Unix socket.
+Requests that arrive within a few milliseconds of each other are run as one batch.
+
+Run with: python3 -m server.inference --socket /tmp/sentiment.sock
+Web workers use it when INFERENCE_SOCKET is set to the same path.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from collections.abc import Callable, Iterator
+
+# How long to wait for more requests before running a batch
+MAX_WAIT = float(os.environ.get("INFERENCE_MAX_WAIT_MS", 5)) / 1000
+
+# Stop gathering once a batch holds this many texts
+MAX_BATCH = int(os.environ.get("INFERENCE_MAX_BATCH", 64))
+
+# Longest request line the service reads; asyncio's default is only 64 KiB
+MAX_REQUEST_BYTES = int(os.environ.get("INFERENCE_MAX_REQUEST_BYTES", 16 * 2**20))
+
+# The client splits longer lists of texts into requests of this many
+MAX_REQUEST_TEXTS = int(os.environ.get("INFERENCE_MAX_REQUEST_TEXTS", 256))
+
+
+class InferenceError(RuntimeError):
+    """The inference service could not score a request"""
+
+
+##############################################################################
+# Server
+#
+
+
+class MicroBatcher:
+    """
+    Gather concurrent scoring requests into a single call to predict
+    predict takes a list of texts and returns one result per text.
+    """
+
+    def __init__(
+        self,
+        predict: Callable[[list[str]], list],
+        max_wait: float = MAX_WAIT,
+        max_batch: int = MAX_BATCH,
+    ):
+        self.predict = predict
+        self.max_wait = max_wait
+        self.max_batch = max_batch
+        self.queue: asyncio.Queue = asyncio.Queue()
+        # The model runs one batch at a time, off the event loop
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    async def score(self, texts: list[str]) -> list:
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((texts, future))
+        return await future
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            size = len(batch[0][0])
+            deadline = loop.time() + self.max_wait
+
+            while size < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                size += len(item[0])
+
+            texts = [text for request, _ in batch for text in request]
+            try:
+                scores = await loop.run_in_executor(self.executor, self.predict, texts)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            start = 0
+            for request, future in batch:
+                if not future.done():
+                    future.set_result(scores[start : start + len(request)])
+                start += len(request)
+
+
+async def handle_connection(
+    batcher: MicroBatcher, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+) -> None:
+    """
+    Answer newline-delimited JSON requests of the form {"texts": [...]}
+    Adding "embeddings": true also returns each text's sentence embedding.
+    """
+
+    try:
+        while True:
+            try:
+                line = await read_request(reader)
+                if not line:
+                    break
+                request = json.loads(line)
+                results = await batcher.score(request_texts(request))
+                response = {"scores": [score for score, _ in results]}
+                if request.get("embeddings"):
+                    response["embeddings"] = [
+                        embedding.tolist() for _, embedding in results
+                    ]
+            except Exception as e:
+                response = {"error": repr(e)}
+            writer.write(json.dumps(response).encode("utf8") + b"\n")
+            await writer.drain()
+    finally:
+        writer.close()
+
+
+async def read_request(reader: asyncio.StreamReader) -> bytes:
+    """
+    Read one request line, or b"" once the client has gone
+    A line over the reader's limit is skipped to its end and raises ValueError, so the
+    client gets an error and the connection stays in step for its next request.
+    """
+
+    try:
+        return await reader.readuntil(b"\n")
+    except asyncio.IncompleteReadError as e:
+        return e.partial
+    except asyncio.LimitOverrunError:
+        pass
+
+    while True:
+        try:
+            await reader.readuntil(b"\n")
+            break
+        except asyncio.LimitOverrunError as e:
+            await reader.readexactly(e.consumed)
+        except asyncio.IncompleteReadError:
+            break
+    raise ValueError("Request is over the size limit")
+
+
+def request_texts(request) -> list[str]:
+    """
+    The texts of a request, checked before they are queued
+    A bad request would otherwise fail the whole batch, and every other client in it.
+    """
+
+    texts = request.get("texts") if isinstance(request, dict) else None
+    if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+        raise ValueError('"texts" must be a list of strings')
+    return texts
+
+
+async def serve(path: str) -> None:
+    """Load the model and listen on a Unix socket"""
+
+    from server.analysis import (
+        configure_threads,
+        get_backend,
+        predict_with_embeddings_locally,
+    )
+
+    configure_threads()
+    get_backend()
+    # Embeddings come from the same forward pass, so they are always kept
+    batcher = MicroBatcher(
+        lambda texts: list(zip(*predict_with_embeddings_locally(texts)))
+    )
+
+    server = await start_server(path, batcher)
+    async with server:
+        await asyncio.gather(server.serve_forever(), batcher.run())
+
+
+async def start_server(
+    path: str, batcher: MicroBatcher, limit: int = MAX_REQUEST_BYTES
+) -> asyncio.AbstractServer:
+    """Listen on a Unix socket, answering requests with batcher"""
+
+    if os.path.exists(path):
+        os.remove(path)
+    return await asyncio.start_unix_server(
+        lambda reader, writer: handle_connection(batcher, reader, writer),
+        path=path,
+        limit=limit,
+    )
+
+
+##############################################################################
+# Client
+#
+
+
+class InferenceClient:
+    """Thin client used by server.analysis when INFERENCE_SOCKET is set"""
+
+    def __init__(self, path: str, timeout: float = 30):
+        self.path = path
+        self.timeout = timeout
+        # One connection per thread, so concurrent requests are batched by the service
+        self._local = threading.local()
+
+    def predict_scores(self, texts: list[str]) -> list[float]:
+        return [
+            score
+            for response in self._requests(texts, {})
+            for score in response["scores"]
+        ]
+
+    def predict_with_embeddings(
+        self, texts: list[str]
+    ) -> tuple[list[float], list[list[float]]]:
+        scores, embeddings = [], []
+        for response in self._requests(texts, {"embeddings": True}):
+            scores.extend(response["scores"])
+            embeddings.extend(response["embeddings"])
+        return scores, embeddings
+
+    def _requests(self, texts: list[str], options: dict) -> Iterator[dict]:
+        """Send texts in slices, so no request line grows without bound"""
+
+        for start in range(0, len(texts), MAX_REQUEST_TEXTS):
+            yield self._request(
+                {"texts": texts[start : start + MAX_REQUEST_TEXTS], **options}
+            )
+
+    def _request(self, body: dict) -> dict:
+        request = json.dumps(body).encode("utf8") + b"\n"
+        try:
+            response = self._send(request)
+        except ConnectionError:
+            # The service may have restarted since this connection was opened. Timeouts
+            # are not retried, as the service is already busy with the request.
+            response = self._send(request)
+
+        if "error" in response:
+            raise InferenceError(response["error"])
+        return response
+
+    def _send(self, request: bytes) -> dict:
+        try:
+            stream = self._connection()
+            stream.write(request)
+            stream.flush()
+            line = stream.readline()
+            if not line:
+                raise ConnectionResetError("Inference service closed the connection")
+        except OSError:
+            # A late answer would be read as the next request's, so start afresh
+            self._close()
+            raise
+        return json.loads(line)
+
+    def _connection(self):
+        if getattr(self._local, "stream", None) is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.path)
+            self._local.sock = sock
+            self._local.stream = sock.makefile("rwb")
+        return self._local.stream
+
+    def _close(self) -> None:
+        for name in ("stream", "sock"):
+            connection = getattr(self._local, name, None)
+            if connection is not None:
+                connection.close()
+            setattr(self._local, name, None)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Run the sentiment inference service")
+    parser.add_argument(
+        "--socket",
+        default=os.environ.get("INFERENCE_SOCKET", "/tmp/sentiment.sock"),
+        help="Path of the Unix socket to listen on",
+    )
+    args = parser.parse_args()
+
+    asyncio.run(serve(args.socket))
@@ -0,0 +1,137 @@
+"""
+Ingest worker
+Polls the feeds that are due and stores their new headlines, outside the web process.
+Each tick it also scores any rewrite a web worker queued and then lost.
+Any number of workers may be started: a Postgres advisory lock makes one of them the
+leader, and the others wait on standby until its connection goes away.
+
+Run with: python3 -m server.ingest
+"""
+
+import argparse
+import logging
+import os
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+
+from flask import Flask
+from sqlalchemy import func, select, text
+from sqlalchemy.exc import DBAPIError
+
+from server import create_app, db
+from server.feeds import poll_due_feeds
+from server.jobs import rescore_stale_rewrites
+
+logger = logging.getLogger(__name__)
+
+# Shared by every ingest worker on the same database
+LOCK_KEY = int(os.environ.get("INGEST_LOCK_KEY", 4_823_190))
+
+# Seconds between checks for due feeds, and between attempts to become leader
+TICK = float(os.environ.get("INGEST_TICK", 60))
+
+# Whether this connection holds the lock. pg_locks splits a bigint key into two halves.
+LOCK_HELD = text(
+    "SELECT EXISTS (SELECT 1 FROM pg_locks WHERE locktype = 'advisory'"
+    " AND pid = pg_backend_pid() AND granted"
+    " AND classid = :high AND objid = :low AND objsubid = 1)"
+).bindparams(high=LOCK_KEY >> 32, low=LOCK_KEY & 0xFFFFFFFF)
+
+
+@contextmanager
+def leader_lock(wait: bool = True) -> Iterator[Callable[[], bool] | None]:
+    """
+    Hold the ingest advisory lock for the duration of the block
+    The lock lives on its own connection, so Postgres releases it if this process dies.
+    Yields a function that checks the lock is still held on that connection, or None
+    straight away if another worker is leader and wait is False.
+    """
+
+    with db.engine.connect() as connection:
+        lock = select(func.pg_try_advisory_lock(LOCK_KEY))
+        while not connection.execute(lock).scalar():
+            if not wait:
+                yield None
+                return
+            logger.info("Another ingest worker is leader, waiting")
+            time.sleep(TICK)
+
+        logger.info("Became the ingest leader")
+
+        def held() -> bool:
+            try:
+                return connection.execute(LOCK_HELD).scalar()
+            except DBAPIError:
+                return False
+
+        try:
+            yield held
+        finally:
+            try:
+                connection.execute(select(func.pg_advisory_unlock(LOCK_KEY)))
+            except DBAPIError:
+                # The connection is gone, and the lock with it
+                pass
+
+
+def run(once: bool = False) -> None:
+    """
+    Poll due feeds until stopped, or once, while holding the leader lock
+    If the lock's connection drops, a standby may take over, so polling stops until
+    this worker is leader again.
+    """
+
+    app = create_app()
+    with app.app_context():
+        while True:
+            with leader_lock(wait=not once) as held:
+                if not held:
+                    logger.info("Another ingest worker is leader, nothing to do")
+                    return
+
+                while held():
+                    tick(app)
+                    if once:
+                        return
+                    time.sleep(TICK)
+
+            logger.warning("Lost the ingest leader lock, waiting to lead again")
+
+
+def tick(app: Flask) -> None:
+    """Poll the due feeds once and score any rewrites left pending"""
+
+    try:
+        polled = poll_due_feeds()
+        if polled:
+            logger.info(
+                "Polled %d feeds, stored %d new headlines, %d errors",
+                polled.feeds,
+                polled.new,
+                polled.errors,
+            )
+        rescored = rescore_stale_rewrites(app)
+        if rescored:
+            logger.info("Scored %d rewrites left pending", rescored)
+    except Exception:
+        logger.exception("Ingest failed")
+        db.session.rollback()
+    finally:
+        db.session.remove()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Poll feeds and store new headlines")
+    parser.add_argument(
+        "--once",
+        action="store_true",
+        help="Poll the due feeds once and exit, if no other worker is leader",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s"
+    )
+    run(once=args.once)
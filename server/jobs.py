@@ -0,0 +1,70 @@
+"""Background scoring for rewrites submitted asynchronously"""
+
+import os
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from uuid import UUID
+
+from flask import Flask
+
+from server.models import Rewrite, db, safe_commit, score_rewrite
+
+# Submissions are only queued here, so the web tier keeps accepting them however
+# far behind the model falls
+executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("REWRITE_SCORING_THREADS", 2)),
+    thread_name_prefix="rewrite-scoring",
+)
+
+# A rewrite still pending after this many seconds was lost with the worker that queued it
+STALE_AFTER = int(os.environ.get("REWRITE_STALE_AFTER", 300))
+
+
+def submit_scoring(app: Flask, rewrite_id: UUID) -> Future:
+    """Queue a pending rewrite to be scored in the background"""
+
+    return executor.submit(run_scoring, app, rewrite_id)
+
+
+def run_scoring(app: Flask, rewrite_id: UUID) -> str | None:
+    """Score a pending rewrite and store the result. Returns the new status"""
+
+    with app.app_context():
+        rewrite = Rewrite.query.get(rewrite_id)
+        if not rewrite or rewrite.status != "pending":
+            return None
+
+        try:
+            score_rewrite(rewrite, rewrite.headline)
+        except Exception:
+            app.logger.exception("Could not score rewrite %s", rewrite_id)
+            db.session.rollback()
+            rewrite.status = "failed"
+
+        msg = safe_commit(None)[0]
+        if msg == "failure":
+            return None
+
+        return rewrite.status
+
+
+def rescore_stale_rewrites(app: Flask, now: datetime | None = None) -> int:
+    """
+    Score the rewrites left pending by a web worker that was killed, and return how many
+    The queue lives in the worker's memory, so a timeout, OOM kill or restart drops it.
+    Each stale rewrite is tried once more here, and ends up complete or failed.
+    """
+
+    cutoff = (now or datetime.now()) - timedelta(seconds=STALE_AFTER)
+    with app.app_context():
+        stale = [
+            rewrite_id
+            for (rewrite_id,) in db.session.query(Rewrite.id).filter(
+                Rewrite.status == "pending", Rewrite.timestamp < cutoff
+            )
+        ]
+
+    for rewrite_id in stale:
+        run_scoring(app, rewrite_id)
+
+    return len(stale)
@@ -3,20 +3,28 @@
 from collections.abc import Callable
 from typing import Dict
 import uuid
+import base64
+import binascii
+import json
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB, UUID
 from sqlalchemy.exc import IntegrityError, NoResultFound
+from sqlalchemy import tuple_
 from sqlalchemy.orm import backref
 from flask_bcrypt import Bcrypt
 from datetime import date, datetime
 import traceback
+import numpy as np
 
-from server.analysis import calc_sentiment_score
+from flask import has_app_context
+from sqlalchemy.dialects.postgresql import insert
+
+from server.analysis import score_cache, text_hash as hash_text
+from server.semantic import embed_text, score_and_embed, similarity
 
 bcrypt = Bcrypt()
 from . import db
 
-
 ##############################################################################
 # User
 #
@@ -68,16 +76,31 @@ class Headline(db.Model):
 
     __tablename__ = "headlines"
 
+    # A source never gets the same headline twice. The constraint's index also serves
+    # lookups by source_id alone.
+    __table_args__ = (db.UniqueConstraint("source_id", "text_hash"),)
+
     id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
 
     text = db.Column(db.String, nullable=False)
 
+    # sha256 of text, so duplicates can be found with a short indexed key
+    text_hash = db.Column(
+        db.String(64),
+        nullable=False,
+        default=lambda context: hash_text(context.get_current_parameters()["text"]),
+    )
+
     sentiment_score = db.Column(db.Float, nullable=False)
 
-    date = db.Column(db.Date, nullable=False)
+    # The random headline pool and the feeds filter on recent dates
+    date = db.Column(db.Date, nullable=False, index=True)
 
     url = db.Column(db.String)
 
+    # Unit-length text embedding, computed once at ingest for semantic matching
+    embedding = db.Column(ARRAY(db.Float))
+
     source_id = db.Column(
         UUID(as_uuid=True), db.ForeignKey("sources.id"), nullable=False
     )
@@ -93,11 +116,85 @@ def new_headline(text: str, date: date, source_id: UUID, url="") -> Headline:
     Does not store headline in database
     """
 
-    score = calc_sentiment_score(text)
+    [score], [embedding] = score_and_embed([text])
 
     return Headline(
-        text=text, date=date, source_id=source_id, url=url, sentiment_score=score
+        text=text,
+        date=date,
+        source_id=source_id,
+        url=url,
+        sentiment_score=score,
+        embedding=to_column(embedding),
+    )
+
+
+def find_new_items(items: list[dict], source_id: UUID) -> dict[str, dict]:
+    """Items with text that the source does not have yet, keyed by text hash"""
+
+    by_hash = {}
+    for item in items:
+        if item.get("text"):
+            by_hash.setdefault(hash_text(item["text"]), item)
+    if not by_hash:
+        return {}
+
+    existing = db.session.query(Headline.text_hash).filter(
+        Headline.source_id == source_id, Headline.text_hash.in_(by_hash)
     )
+    for (key,) in existing:
+        del by_hash[key]
+
+    return by_hash
+
+
+def headline_rows(
+    items: dict[str, dict],
+    source_id: UUID,
+    scores: list[float],
+    embeddings: list[np.ndarray | None],
+) -> list[dict]:
+    """Rows for write_headlines from new items and their scores and embeddings"""
+
+    return [
+        {
+            "id": uuid.uuid4(),
+            "text": item["text"],
+            "text_hash": key,
+            "sentiment_score": score,
+            # Feeds sometimes leave out the date, so count it as published today
+            "date": item.get("date") or date.today(),
+            "url": item.get("url", ""),
+            "embedding": to_column(embedding),
+            "source_id": source_id,
+        }
+        for (key, item), score, embedding in zip(items.items(), scores, embeddings)
+    ]
+
+
+def write_headlines(rows: list[dict]) -> int:
+    """Insert scored headline rows in one statement, skipping any that already exist"""
+
+    if not rows:
+        return 0
+
+    statement = (
+        insert(Headline.__table__)
+        .values(rows)
+        .on_conflict_do_nothing(index_elements=["source_id", "text_hash"])
+    )
+    return db.session.execute(statement).rowcount
+
+
+def to_column(embedding: np.ndarray | None) -> list[float] | None:
+    """Convert an embedding for storage in an ARRAY column"""
+
+    return None if embedding is None else embedding.tolist()
+
+
+def to_embedding(column: list[float] | None) -> np.ndarray | None:
+    """Convert an ARRAY column back to an embedding"""
+
+    return None if column is None else np.asarray(column, dtype=np.float32)
 
 
 # def calc_sentiment_score(text: str) -> float:
@@ -107,7 +204,79 @@ def new_headline(text: str, date: date, source_id: UUID, url="") -> Headline:
 
 
 ##############################################################################
-# Rewrite
+# Sentiment cache
+#
+
+
+class SentimentCache(db.Model):
+    """Sentiment scores shared by every worker, keyed on normalized text and model version"""
+
+    __tablename__ = "sentiment_cache"
+
+    text_hash = db.Column(db.String(64), primary_key=True)
+
+    model_version = db.Column(db.String, primary_key=True)
+
+    score = db.Column(db.Float, nullable=False)
+
+    # Embedding from the same forward pass, if the text was scored with one
+    embedding = db.Column(ARRAY(db.Float))
+
+
+class SentimentCacheStore:
+    """Second tier of server.analysis.score_cache, backed by the sentiment_cache table"""
+
+    def get_many(
+        self, keys: list[str], model_version: str
+    ) -> dict[str, tuple[float, np.ndarray | None]]:
+        if not has_app_context():
+            return {}
+
+        rows = db.session.query(
+            SentimentCache.text_hash, SentimentCache.score, SentimentCache.embedding
+        ).filter(
+            SentimentCache.model_version == model_version,
+            SentimentCache.text_hash.in_(keys),
+        )
+        return {key: (score, to_embedding(embedding)) for key, score, embedding in rows}
+
+    def put_many(
+        self, entries: dict[str, tuple[float, np.ndarray | None]], model_version: str
+    ) -> None:
+        if not has_app_context():
+            return
+
+        # A text first scored without its embedding gets it added later
+        table = SentimentCache.__table__
+        statement = insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.text_hash, table.c.model_version],
+            set_={"embedding": statement.excluded.embedding},
+            where=table.c.embedding.is_(None)
+            & statement.excluded.embedding.isnot(None),
+        )
+
+        # Use a separate transaction so caching never commits the caller's session
+        with db.engine.begin() as connection:
+            connection.execute(
+                statement,
+                [
+                    {
+                        "text_hash": key,
+                        "model_version": model_version,
+                        "score": score,
+                        "embedding": to_column(embedding),
+                    }
+                    for key, (score, embedding) in entries.items()
+                ],
+            )
+
+
+score_cache.store = SentimentCacheStore()
+
+
+##############################################################################
+# Source
 #
 
 
@@ -126,6 +295,92 @@ class Source(db.Model):
     alignment = db.Column(db.String)
 
 
+class Feed(db.Model):
+    """
+    A source's RSS, Atom or sitemap feed
+    Besides the url, this holds how to parse the feed, how often to poll it and its state
+    from the last poll, for conditional requests.
+    """
+
+    __tablename__ = "feeds"
+
+    id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+
+    url = db.Column(db.String, nullable=False, unique=True)
+
+    source_id = db.Column(
+        UUID(as_uuid=True), db.ForeignKey("sources.id"), nullable=False
+    )
+
+    # Key of server.feeds.PARSERS
+    parser = db.Column(db.String(20), nullable=False, default="rss")
+
+    # Seconds between polls, adjusted after each poll by how many new items it found
+    poll_interval = db.Column(db.Integer, nullable=False, default=3 * 60 * 60)
+
+    next_poll_at = db.Column(db.DateTime, index=True)
+
+    etag = db.Column(db.String)
+
+    last_modified = db.Column(db.String)
+
+    # sha256 of the last body, for servers that send neither header
+    content_hash = db.Column(db.String(64))
+
+    checked_at = db.Column(db.DateTime)
+
+    source = db.relationship("Source", backref=backref("feeds", cascade="all, delete"))
+
+    def validators(self) -> dict[str, str | None]:
+        return {
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "content_hash": self.content_hash,
+        }
+
+
+##############################################################################
+# Ingest runs
+#
+
+
+class IngestRun(db.Model):
+    """Stats of one ingest run, overall and for each feed it polled"""
+
+    __tablename__ = "ingest_runs"
+
+    id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+
+    started_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    finished_at = db.Column(db.DateTime)
+
+    feeds = db.Column(db.Integer, nullable=False, default=0)
+
+    # Headlines parsed from changed feeds, already stored, and newly stored
+    fetched = db.Column(db.Integer, nullable=False, default=0)
+
+    duplicates = db.Column(db.Integer, nullable=False, default=0)
+
+    new = db.Column(db.Integer, nullable=False, default=0)
+
+    errors = db.Column(db.Integer, nullable=False, default=0)
+
+    # Busy time of each pipeline stage, summed over its threads
+    fetch_seconds = db.Column(db.Float, nullable=False, default=0)
+
+    parse_seconds = db.Column(db.Float, nullable=False, default=0)
+
+    dedup_seconds = db.Column(db.Float, nullable=False, default=0)
+
+    score_seconds = db.Column(db.Float, nullable=False, default=0)
+
+    write_seconds = db.Column(db.Float, nullable=False, default=0)
+
+    # One dict per feed, with the same counts, its stage timings and error messages
+    feed_stats = db.Column(JSONB, nullable=False, default=list)
+
+
 ##############################################################################
 # Rewrite
 #
@@ -136,6 +391,11 @@ class Rewrite(db.Model):
 
     __tablename__ = "rewrites"
 
+    # A user's history is paged newest first, by (timestamp, id)
+    __table_args__ = (
+        db.Index("ix_rewrites_user_id_timestamp", "user_id", "timestamp", "id"),
+    )
+
     id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
 
     text = db.Column(db.String, nullable=False)
@@ -143,16 +403,20 @@ class Rewrite(db.Model):
     user_id = db.Column(UUID(as_uuid=True), db.ForeignKey("users.id"), nullable=False)
 
     headline_id = db.Column(
-        UUID(as_uuid=True), db.ForeignKey("headlines.id"), nullable=False
+        UUID(as_uuid=True), db.ForeignKey("headlines.id"), nullable=False, index=True
     )
 
-    sentiment_score = db.Column(db.Float, nullable=False)
+    # Scores are empty while an asynchronously submitted rewrite is pending
+    sentiment_score = db.Column(db.Float)
+
+    sentiment_match = db.Column(db.Float)
 
-    sentiment_match = db.Column(db.Float, nullable=False)
+    semantic_match = db.Column(db.Float)
 
-    semantic_match = db.Column(db.Float, nullable=False)
+    # pending, complete or failed
+    status = db.Column(db.String(10), nullable=False, default="complete")
 
-    timestamp = db.Column(db.DateTime, default=datetime.now())
+    timestamp = db.Column(db.DateTime, default=datetime.now)
 
     user = db.relationship("User", backref=backref("rewrites", cascade="all, delete"))
 
@@ -164,24 +428,91 @@ class Rewrite(db.Model):
 def new_rewrite(text: str, headline: Headline, user_id: UUID) -> Rewrite:
     """Build new rewrite. Does not save to database"""
 
-    sentiment_score = calc_sentiment_score(text)
-    sentiment_match = sentiment_score - headline.sentiment_score
-    semantic_match = calc_semantic_match(text, headline.text)
+    rewrite = Rewrite(text=text, user_id=user_id, headline_id=headline.id)
+
+    return score_rewrite(rewrite, headline)
+
+
+def new_pending_rewrite(text: str, headline: Headline, user_id: UUID) -> Rewrite:
+    """
+    Build new rewrite without scoring it, for server.jobs to score later.
+    Does not save to database
+    """
 
     return Rewrite(
-        text=text,
-        sentiment_score=sentiment_score,
-        sentiment_match=sentiment_match,
-        semantic_match=semantic_match,
-        user_id=user_id,
-        headline_id=headline.id,
+        text=text, user_id=user_id, headline_id=headline.id, status="pending"
+    )
+
+
+def score_rewrite(rewrite: Rewrite, headline: Headline) -> Rewrite:
+    """Fill in a rewrite's scores and mark it complete"""
+
+    # One forward pass gives both scores when SEMANTIC_BACKEND is transformer
+    [sentiment_score], [embedding] = score_and_embed([rewrite.text])
+
+    rewrite.sentiment_score = sentiment_score
+    rewrite.sentiment_match = sentiment_score - headline.sentiment_score
+    rewrite.semantic_match = semantic_match(embedding, headline)
+    rewrite.status = "complete"
+
+    return rewrite
+
+
+def semantic_match(embedding: np.ndarray | None, headline: Headline) -> float:
+    """
+    How close in meaning an embedded rewrite is to its headline, from 0 to 1
+    Only the rewrite is embedded per request; the headline's is stored at ingest.
+    """
+
+    if embedding is None:
+        return 0.0
+
+    # Embeddings stored by a different SEMANTIC_BACKEND have a different size
+    if headline.embedding is None or len(headline.embedding) != len(embedding):
+        return similarity(embedding, embed_text(headline.text))
+
+    return similarity(embedding, to_embedding(headline.embedding))
+
+
+def rewrite_history(user_id: UUID, before: tuple[datetime, UUID] | None = None):
+    """
+    Query for a user's rewrites, newest first, with their headlines' columns
+    before is the (timestamp, id) of the last rewrite already seen. Paging on those
+    keys rather than an offset is served by ix_rewrites_user_id_timestamp however
+    deep the page.
+
+    Rows hold only the columns serialize would read; split them with rewrite_json and
+    headline_json(row, "headline__").
+    """
+
+    query = (
+        db.session.query(*rewrite_columns(), *headline_columns("headline__"))
+        .join(Headline, Rewrite.headline_id == Headline.id)
+        .join(Source, Headline.source_id == Source.id)
+        .filter(Rewrite.user_id == user_id)
+        .order_by(Rewrite.timestamp.desc(), Rewrite.id.desc())
     )
+    if before:
+        query = query.filter(tuple_(Rewrite.timestamp, Rewrite.id) < before)
+
+    return query
+
+
+def encode_cursor(timestamp: datetime, rewrite_id: UUID) -> str:
+    """Opaque cursor pointing just after a rewrite in rewrite_history"""
 
+    key = json.dumps([timestamp.isoformat(), str(rewrite_id)])
+    return base64.urlsafe_b64encode(key.encode("utf8")).decode("ascii")
 
-def calc_semantic_match(rewrite: str, headline: str) -> float:
-    """TODO Use Gensim"""
 
-    return 1.0
+def decode_cursor(cursor: str) -> tuple[datetime, UUID]:
+    """Keys for rewrite_history from encode_cursor. Raises ValueError if malformed"""
+
+    try:
+        timestamp, rewrite_id = json.loads(base64.urlsafe_b64decode(cursor))
+        return datetime.fromisoformat(timestamp), uuid.UUID(rewrite_id)
+    except (TypeError, ValueError, binascii.Error) as e:
+        raise ValueError(f"Malformed cursor {cursor!r}") from e
 
 
 ###################################################
@@ -250,62 +581,95 @@ def new_anon_user():
     return User(username=uuid.uuid4(), email=uuid.uuid4(), anonymous=True)
 
 
+# Fields of the JSON for each model, shared by serialize and the column projections
+HEADLINE_FIELDS = ("id", "text", "sentiment_score", "date", "source_id", "url")
+
+REWRITE_FIELDS = (
+    "id",
+    "text",
+    "sentiment_score",
+    "sentiment_match",
+    "semantic_match",
+    "user_id",
+    "headline_id",
+    "timestamp",
+    "status",
+)
+
+
 def serialize(
-    obj: (Headline | Rewrite), with_rewrites=False, user=None
+    obj: Headline | Rewrite | IngestRun, with_rewrites=False, user=None
 ) -> dict[str, (str | float)]:
     """Return serialized headline"""
 
     match obj:
         case Headline():
+            serialized = {field: getattr(obj, field) for field in HEADLINE_FIELDS}
+            serialized["source"] = obj.source.name
             if with_rewrites:
-                if user:
-                    return {
-                        "id": obj.id,
-                        "text": obj.text,
-                        "sentiment_score": obj.sentiment_score,
-                        "date": obj.date,
-                        "source_id": obj.source_id,
-                        "source": obj.source.name,
-                        "url": obj.url,
-                        "rewrites": [
-                            serialize(rewrite)
-                            for rewrite in obj.rewrites
-                            if rewrite.user == user
-                        ],
-                    }
-                return {
-                    "id": obj.id,
-                    "text": obj.text,
-                    "sentiment_score": obj.sentiment_score,
-                    "date": obj.date,
-                    "source_id": obj.source_id,
-                    "source": obj.source.name,
-                    "url": obj.url,
-                    "rewrites": [serialize(rewrite) for rewrite in obj.rewrites],
-                }
-            return {
-                "id": obj.id,
-                "text": obj.text,
-                "sentiment_score": obj.sentiment_score,
-                "date": obj.date,
-                "source_id": obj.source_id,
-                "source": obj.source.name,
-                "url": obj.url,
-            }
+                serialized["rewrites"] = [
+                    serialize(rewrite)
+                    for rewrite in obj.rewrites
+                    if user is None or rewrite.user_id == user.id
+                ]
+            return serialized
 
         case Rewrite():
+            return {field: getattr(obj, field) for field in REWRITE_FIELDS}
+
+        case IngestRun():
             return {
                 "id": obj.id,
-                "text": obj.text,
-                "sentiment_score": obj.sentiment_score,
-                "sentiment_match": obj.sentiment_match,
-                "semantic_match": obj.semantic_match,
-                "user_id": obj.user_id,
-                "headline_id": obj.headline_id,
-                "timestamp": obj.timestamp,
+                "started_at": obj.started_at,
+                "finished_at": obj.finished_at,
+                "feeds": obj.feeds,
+                "fetched": obj.fetched,
+                "duplicates": obj.duplicates,
+                "new": obj.new,
+                "errors": obj.errors,
+                "seconds": {
+                    "fetch": obj.fetch_seconds,
+                    "parse": obj.parse_seconds,
+                    "dedup": obj.dedup_seconds,
+                    "score": obj.score_seconds,
+                    "write": obj.write_seconds,
+                },
+                "feed_stats": obj.feed_stats,
             }
 
 
+def headline_columns(prefix: str = "") -> list:
+    """
+    Columns for the same JSON as serialize(headline), including the source's name
+    Queries selecting these need to join sources. Reading plain rows skips building ORM
+    objects and lazy-loading their relationships.
+    """
+
+    return [
+        getattr(Headline, field).label(prefix + field) for field in HEADLINE_FIELDS
+    ] + [Source.name.label(prefix + "source")]
+
+
+def rewrite_columns(prefix: str = "") -> list:
+    """Columns for the same JSON as serialize(rewrite)"""
+
+    return [getattr(Rewrite, field).label(prefix + field) for field in REWRITE_FIELDS]
+
+
+def headline_json(row, prefix: str = "") -> dict:
+    """Headline JSON from a row selecting headline_columns(prefix)"""
+
+    mapping = row._mapping
+    return {field: mapping[prefix + field] for field in HEADLINE_FIELDS + ("source",)}
+
+
+def rewrite_json(row, prefix: str = "") -> dict:
+    """Rewrite JSON from a row selecting rewrite_columns(prefix)"""
+
+    mapping = row._mapping
+    return {field: mapping[prefix + field] for field in REWRITE_FIELDS}
+
+
 ###################################################
 # Monads
 #
@@ -2,7 +2,6 @@
 
 from functools import wraps
 from uuid import UUID
-from datetime import date, timedelta
 import uuid
 from flask import (
     current_app as app,
@@ -13,14 +12,12 @@ from flask import (
     request,
     jsonify,
     session,
+    stream_with_context,
 )
 from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy.sql import func
 
-import atexit
-from apscheduler.schedulers.background import BackgroundScheduler
-
-from server.seed import add_headlines
+from server.jobs import submit_scoring
+from server.sampling import recent_headlines
 from server.forms import (
     ChangePasswordForm,
     RewriteForm,
@@ -33,23 +30,87 @@ from server.models import (
     authenticate_user,
     User,
     Headline,
+    IngestRun,
     Rewrite,
     change_password,
+    decode_cursor,
+    encode_cursor,
+    headline_json,
     new_anon_user,
+    new_pending_rewrite,
     new_rewrite,
     new_user,
+    rewrite_history,
+    rewrite_json,
     safe_delete,
     serialize,
     Failure,
     safe_commit,
 )
 
-# Move this elsewhere
-scheduler = BackgroundScheduler()
-scheduler.add_job(func=add_headlines, trigger="interval", hours=3)
-scheduler.start()
+# Rewrites per page of a user's history
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+
+# Rows fetched from the server-side cursor at a time when streaming
+STREAM_BATCH = 200
+
+##############################################################################
+# Principal
+#
+
+
+class Principal:
+    """
+    Who the visitor is, as far as most pages need to know
+    Built from claims in the signed session cookie, so it costs no database query.
+    Routes that need the rest of the user's row use @get_full_user instead.
+    """
+
+    def __init__(self, id: UUID, anonymous: bool):
+        self.id = id
+        self.anonymous = anonymous
+
+
+def remember_user(user: User) -> None:
+    """Store the user's id and claims in the session"""
+
+    session["user_id"] = user.id
+    session["anonymous"] = bool(user.anonymous)
+
+
+def forget_user() -> None:
+    """Remove the user's id and claims from the session"""
+
+    session.pop("user_id", None)
+    session.pop("anonymous", None)
+
+
+def user_exists(user_id: UUID) -> bool:
+    """Whether the user behind a session's claims is still in the database"""
+
+    return (
+        User.query.with_entities(User.id).filter(User.id == user_id).first() is not None
+    )
+
+
+def current_principal() -> Principal | None:
+    """The visitor from the session, or None if they are not known"""
+
+    user_id = session.get("user_id")
+    if not user_id:
+        return None
+
+    if "anonymous" not in session:
+        # Sessions from before claims were stored need one lookup
+        user = Failure(user_id).bind(User.query.get).value
+        if not user:
+            forget_user()
+            return None
+        remember_user(user)
+
+    return Principal(user_id, session["anonymous"])
 
-atexit.register(lambda: scheduler.shutdown())
 
 ##############################################################################
 # Decorators
@@ -62,8 +123,15 @@ def rate_limit(route):
     @wraps(route)
     def wrapper(*args, **kwargs):
 
-        current_user = Failure(session.get("user_id")).bind(User.query.get)
-        if not current_user.value:
+        current_user = current_principal()
+
+        # Claims can outlive their user, e.g. when the database is reseeded, and this
+        # route stores rows that reference it, so the one write path checks it exists
+        if current_user and not user_exists(current_user.id):
+            forget_user()
+            current_user = None
+
+        if not current_user:
 
             # This allows the system to have a unique user ID for every rewrite in the system, and to
             # potentially replace the anon user with a real user after login
@@ -71,14 +139,14 @@ def rate_limit(route):
             committed_anon = safe_commit(anon_user)
 
             session["requests_remaining"] = 9
-            session["user_id"] = committed_anon[1].id
+            remember_user(committed_anon[1])
             return route(*args, **kwargs, current_user=committed_anon[1].id)
 
-        if current_user.value.anonymous:
+        if current_user.anonymous:
             requests_remaining = session.get("requests_remaining", 0)
             if requests_remaining > 0:
                 session["requests_remaining"] = requests_remaining - 1
-                return route(*args, **kwargs, current_user=current_user.value.id)
+                return route(*args, **kwargs, current_user=current_user.id)
             else:
                 return (
                     jsonify(error="Please login before making additional requests."),
@@ -86,13 +154,24 @@ def rate_limit(route):
                 )
 
         else:
-            return route(*args, **kwargs, current_user=current_user.value.id)
+            return route(*args, **kwargs, current_user=current_user.id)
 
     return wrapper
 
 
 def get_user(route):
-    """Get user from session and pass to route"""
+    """Get the visitor from the session's claims and pass to route"""
+
+    @wraps(route)
+    def wrapper(*args, **kwargs):
+
+        return route(*args, **kwargs, current_user=current_principal())
+
+    return wrapper
+
+
+def get_full_user(route):
+    """Get user from the database and pass to route"""
 
     @wraps(route)
     def wrapper(*args, **kwargs):
@@ -122,6 +201,24 @@ def submit_rewrite(current_user: UUID) -> tuple[Response, int]:
     if not headline.value:
         return (jsonify(error="Headline not found."), 404)
 
+    # Async submissions are saved as pending, scored in the background, and
+    # picked up by polling GET /api/rewrites/<id>
+    if request.json.get("async"):
+        rewrite = new_pending_rewrite(
+            text=text, headline=headline.value, user_id=current_user
+        )
+        committed_rewrite = safe_commit(rewrite)
+        if committed_rewrite[0] == "failure":
+            return (jsonify(error="Error saving to database."), 500)
+
+        rewrite_id = committed_rewrite[1].id
+        submit_scoring(app._get_current_object(), rewrite_id)
+        return (
+            jsonify(job={"id": rewrite_id, "status": "pending"}),
+            202,
+            {"Location": f"/api/rewrites/{rewrite_id}"},
+        )
+
     rewrite = new_rewrite(text=text, headline=headline.value, user_id=current_user)
     committed_rewrite = safe_commit(rewrite)
     if committed_rewrite[0] == "failure":
@@ -130,16 +227,31 @@ def submit_rewrite(current_user: UUID) -> tuple[Response, int]:
     return (jsonify(rewrite=serialize(committed_rewrite[1])), 201)
 
 
+@app.get("/api/rewrites/<uuid:rewrite_id>")
+@get_user
+def get_rewrite(rewrite_id, current_user: Principal | None) -> tuple[Response, int]:
+    """Get a rewrite, including the status of its scoring job"""
+
+    rewrite = Failure(rewrite_id).bind(Rewrite.query.get)
+    if not rewrite.value:
+        return (jsonify(error="Rewrite not found."), 404)
+
+    if not current_user or current_user.id != rewrite.value.user_id:
+        return (jsonify(error="You do not have access to this resource."), 403)
+
+    return (jsonify(rewrite=serialize(rewrite.value)), 200)
+
+
 @app.delete("/api/rewrites/<uuid:rewrite_id>")
 @get_user
-def delete_rewrite(rewrite_id, current_user: User):
+def delete_rewrite(rewrite_id, current_user: Principal | None):
     """Delete a rewrite"""
 
     rewrite = Failure(rewrite_id).bind(Rewrite.query.get)
     if not rewrite.value:
         return (jsonify(error="Rewrite not found."), 404)
 
-    if current_user != rewrite.value.user:
+    if not current_user or current_user.id != rewrite.value.user_id:
         return (jsonify(error="You do not have access to this resource."), 403)
 
     msg = safe_delete(rewrite.value)
@@ -152,42 +264,86 @@ def delete_rewrite(rewrite_id, current_user: User):
 
 @app.get("/api/headlines/random")
 def get_random_headline() -> tuple[Response, int]:
-    """Get a random headline"""
+    """Get a random headline from the last few days"""
 
-    # From https://stackoverflow.com/a/33583008/6632828
-    headline = (
-        Headline.query.filter(
-            func.date(Headline.date).between(
-                date.today() - timedelta(days=4), date.today()
-            )
-        )
-        .order_by(func.random())
-        .first()
-    )
-    return (jsonify(headline=serialize(headline)), 200)
+    return (Response(recent_headlines.choice(), mimetype="application/json"), 200)
 
 
 @app.get("/api/users/<string:user_id>/rewrites")
 @get_user
-def get_all_rewrites(user_id: str, current_user: User) -> tuple | list:
+def get_all_rewrites(user_id: str, current_user: Principal | None) -> tuple | Response:
     """
-    Get all rewrites by a user
+    Get a page of a user's rewrites, newest first, grouped by headline
     It might be better to always demand a real user id, but then
     the frontend would need to get that somehow, which would slow things down.
-    TODO This is probably much more inefficient than it could be
+    Pass the returned next_cursor as ?cursor= for the next page; it is null after the
+    last one. With ?stream=true the whole history is sent as newline-delimited JSON
+    instead, one headline with one rewrite per line, read from a server-side cursor.
     """
 
-    if user_id != "logged_in_user" and current_user.id != uuid.UUID(user_id):
+    if not current_user or (
+        user_id != "logged_in_user" and current_user.id != uuid.UUID(user_id)
+    ):
         return (jsonify(error="You do not have access to this resource."), 403)
 
-    rewrites = Rewrite.query.filter(Rewrite.user == current_user).all()
-    headlines = set([rewrite.headline for rewrite in rewrites])
-    json_headlines = [
-        serialize(headline, with_rewrites=True, user=current_user)
-        for headline in headlines
-    ]
+    try:
+        before = (
+            decode_cursor(request.args["cursor"]) if "cursor" in request.args else None
+        )
+    except ValueError:
+        return (jsonify(error="Invalid cursor."), 400)
+
+    query = rewrite_history(current_user.id, before)
+
+    if request.args.get("stream") == "true":
+        rows = query.execution_options(stream_results=True).yield_per(STREAM_BATCH)
+        lines = (
+            json_line(
+                headline_json(row, "headline__") | {"rewrites": [rewrite_json(row)]}
+            )
+            for row in rows
+        )
+        return Response(stream_with_context(lines), mimetype="application/x-ndjson")
+
+    limit = request.args.get("limit", PAGE_SIZE, type=int)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    # One extra row says whether there is another page
+    rows = query.limit(limit + 1).all()
+    page = rows[:limit]
+
+    headlines = {}
+    for row in page:
+        if row.headline_id not in headlines:
+            headlines[row.headline_id] = headline_json(row, "headline__") | {
+                "rewrites": []
+            }
+        headlines[row.headline_id]["rewrites"].append(rewrite_json(row))
+
+    last = page[-1] if len(rows) > len(page) else None
+    return (
+        jsonify(
+            headlines=list(headlines.values()),
+            next_cursor=encode_cursor(last.timestamp, last.id) if last else None,
+        ),
+        200,
+    )
+
+
+def json_line(obj: dict) -> str:
+    return app.json.dumps(obj) + "\n"
+
+
+@app.get("/api/admin/ingest-runs")
+@get_full_user
+def get_ingest_runs(current_user: User) -> tuple[Response, int]:
+    """Get the most recent ingest runs, with their per-feed stats"""
 
-    return json_headlines
+    if not current_user or not current_user.admin:
+        return (jsonify(error="You do not have access to this resource."), 403)
+
+    limit = max(1, min(request.args.get("limit", 20, type=int), 100))
+    runs = IngestRun.query.order_by(IngestRun.started_at.desc()).limit(limit)
+    return (jsonify(runs=[serialize(run) for run in runs]), 200)
 
 
 ##############################################################################
@@ -233,7 +389,7 @@ def signup_page(current_user):
             flash("That username or email is already in use.", "danger")
             return redirect("/signup")
 
-        session["user_id"] = committed_user[1].id
+        remember_user(committed_user[1])
         flash("Thanks for signing up.", "success")
         return redirect("/")
 
@@ -254,7 +410,7 @@ def login_page(current_user):
         user = authenticate_user(form.username.data, form.password.data)
 
         if user:
-            session["user_id"] = user.id
+            remember_user(user)
             flash(f"Welcome back, {user.username}.", "success")
             return redirect("/")
 
@@ -269,7 +425,7 @@ def login_page(current_user):
 def logout():
     """Logout user and redirect to index"""
     if session.get("user_id"):
-        session.pop("user_id")
+        forget_user()
 
     flash("Logged out successfully", "success")
     return redirect("/")
@@ -283,7 +439,7 @@ def all_rewrites(current_user):
 
 
 @app.route("/profile", methods=["GET", "POST"])
-@get_user
+@get_full_user
 def profile_page(current_user):
     """
     Profile
@@ -328,7 +484,7 @@ def profile_page(current_user):
 
 
 @app.route("/password", methods=["GET", "POST"])
-@get_user
+@get_full_user
 def edit_password_page(current_user):
     """
     Password
@@ -380,5 +536,4 @@ def edit_password_page(current_user):
 def page_not_found(e):
 
     # Cannot use the @get_user decorator here
-    user = Failure(session.get("user_id")).bind(User.query.get)
-    return render_template("404.html", user=user), 404
+    return render_template("404.html", user=current_principal()), 404
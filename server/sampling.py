@@ -0,0 +1,106 @@
+"""Random headlines from an in-memory pool of recent ones"""
+
+import os
+import random
+import threading
+from datetime import date, timedelta
+from time import monotonic
+
+from flask import current_app
+from server.models import (
+    Headline,
+    IngestRun,
+    Source,
+    db,
+    headline_columns,
+    headline_json,
+)
+
+# Headlines published within this many days are eligible
+WINDOW_DAYS = int(os.environ.get("RANDOM_HEADLINE_DAYS", 4))
+
+# Seconds between checks for a newer ingest run, and between full refreshes regardless
+CHECK_INTERVAL = float(os.environ.get("HEADLINE_POOL_CHECK", 30))
+TTL = float(os.environ.get("HEADLINE_POOL_TTL", 600))
+
+
+class HeadlinePool:
+    """
+    Pre-serialized JSON responses for every headline in the recent window
+    Picking one is O(1) however many headlines there are. The pool is rebuilt when the
+    ingest worker records a new run, which is checked at most every check_interval
+    seconds, and after ttl seconds in any case so the window moves with the date.
+    """
+
+    def __init__(self, check_interval: float = CHECK_INTERVAL, ttl: float = TTL):
+        self.check_interval = check_interval
+        self.ttl = ttl
+        self._responses: list[str] = []
+        self._empty = ""
+        self._run_id = None
+        self._loaded_at = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._responses)
+
+    def choice(self) -> str:
+        """JSON body for a random recent headline, or a null headline if there are none"""
+
+        self.refresh_if_stale()
+        responses = self._responses
+        return random.choice(responses) if responses else self._empty
+
+    def refresh_if_stale(self) -> None:
+        now = monotonic()
+        if self._checked_recently(now):
+            return
+
+        with self._lock:
+            if self._checked_recently(now):
+                return
+
+            run_id = latest_run_id()
+            expired = self._loaded_at is None or now - self._loaded_at >= self.ttl
+            if expired or run_id != self._run_id:
+                self.refresh()
+                self._run_id = run_id
+                self._loaded_at = now
+            self._checked_at = now
+
+    def _checked_recently(self, now: float) -> bool:
+        return (
+            self._checked_at is not None
+            and now - self._checked_at < self.check_interval
+        )
+
+    def refresh(self) -> None:
+        """Load and serialize the headlines in the window"""
+
+        today = date.today()
+        rows = (
+            db.session.query(*headline_columns())
+            .join(Source, Headline.source_id == Source.id)
+            .filter(Headline.date.between(today - timedelta(days=WINDOW_DAYS), today))
+        )
+        dumps = current_app.json.dumps
+        self._responses = [dumps({"headline": headline_json(row)}) for row in rows]
+        self._empty = dumps({"headline": None})
+
+    def invalidate(self) -> None:
+        """Reload on the next request"""
+
+        self._checked_at = None
+        self._loaded_at = None
+
+
+def latest_run_id():
+    """Id of the most recent ingest run, found through the started_at index"""
+
+    return (
+        db.session.query(IngestRun.id).order_by(IngestRun.started_at.desc()).limit(1)
+    ).scalar()
+
+
+recent_headlines = HeadlinePool()
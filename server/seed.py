@@ -1,38 +1,60 @@
 """Commands for resetting the database and adding more headlines"""
-import atexit
-from apscheduler.schedulers.background import BackgroundScheduler
-from server.models import User, Headline, Rewrite, Source
+
+from flask_migrate import stamp
+
+from server.models import User, Headline, Rewrite, Source, Feed, SentimentCache
 from server import db, create_app
-from server.feeds import send_to_database
+from server.feeds import poll_due_feeds
 
 
 def reset_database():
-    """Deletes and recreates all tables"""
+    """
+    Deletes and recreates all tables
+    The sentiment cache is kept, so reseeding does not rescore every headline
+    """
     db.session.rollback()
-    db.drop_all()
+    tables = [
+        table
+        for table in db.metadata.sorted_tables
+        if table is not SentimentCache.__table__
+    ]
+    db.metadata.drop_all(bind=db.engine, tables=tables)
     db.create_all()
+    # The tables now match the models, so migrations start from the latest revision
+    stamp()
 
 
 def add_sources():
-    """Add sources to source table"""
+    """Add sources and their feeds"""
     sources = [
-        {"name": "New York Times", "url": "nytimes.com", "alignment": "left"},
-        {"name": "Wall Street Journal", "url": "wsj.com", "alignment": "right"},
+        {
+            "name": "New York Times",
+            "url": "nytimes.com",
+            "alignment": "left",
+            "feeds": ["https://rss.nytimes.com/services/xml/rss/nyt/HomePage.xml"],
+        },
+        {
+            "name": "Wall Street Journal",
+            "url": "wsj.com",
+            "alignment": "right",
+            "feeds": [
+                "https://feeds.a.dj.com/rss/RSSMarketsMain.xml",
+                "https://feeds.a.dj.com/rss/RSSWorldNews.xml",
+            ],
+        },
     ]
 
     for source in sources:
-        db.session.add(Source(**source))
+        feeds = [Feed(url=url, parser="rss") for url in source.pop("feeds")]
+        db.session.add(Source(**source, feeds=feeds))
 
     db.session.commit()
 
 
 def add_headlines():
-    """Add headlines to database"""
+    """Add headlines from every feed that is due for a poll"""
     with create_app().app_context():
-        nytimes = Source.query.filter(Source.name == "New York Times").one()
-        wsj = Source.query.filter(Source.name == "Wall Street Journal").one()
-        send_to_database(nytimes)
-        send_to_database(wsj)
+        poll_due_feeds()
 
 
 def seed():
@@ -0,0 +1,110 @@
+"""Semantic similarity, from gensim word vectors or the sentiment model's own embeddings"""
+
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from server.analysis import calc_sentiment_and_embeddings, calc_sentiment_scores
+
+# "word-vectors" averages gensim word vectors. "transformer" reuses the pooled DistilBERT
+# embedding from the sentiment forward pass, so scoring a text costs a single pass.
+BACKEND = os.environ.get("SEMANTIC_BACKEND", "word-vectors")
+
+# Vectors are saved in gensim's native format, which can be memory-mapped
+WORD_VECTORS_PATH = os.environ.get(
+    "WORD_VECTORS_PATH", str(Path(__file__).parent / "models" / "word-vectors.kv")
+)
+
+# gensim-data model downloaded when WORD_VECTORS_PATH does not exist yet
+WORD_VECTORS_MODEL = os.environ.get("WORD_VECTORS_MODEL", "glove-wiki-gigaword-100")
+
+# gensim is only imported when the word-vectors backend is used
+_word_vectors = None
+_word_vectors_lock = threading.Lock()
+
+
+def get_word_vectors():
+    """
+    Load the word vectors the first time they are needed
+    The matrix is memory-mapped read-only, so every worker on a host shares the page
+    cache's copy instead of loading its own.
+    """
+
+    from gensim.models import KeyedVectors
+
+    global _word_vectors
+    if _word_vectors is None:
+        with _word_vectors_lock:
+            if _word_vectors is None:
+                if not os.path.exists(WORD_VECTORS_PATH):
+                    download_word_vectors()
+                _word_vectors = KeyedVectors.load(WORD_VECTORS_PATH, mmap="r")
+    return _word_vectors
+
+
+def download_word_vectors(path: str = WORD_VECTORS_PATH) -> None:
+    """Fetch pretrained vectors and save them where get_word_vectors can mmap them"""
+
+    import gensim.downloader
+
+    vectors = gensim.downloader.load(WORD_VECTORS_MODEL)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    vectors.save(path)
+
+
+def score_and_embed(texts: list[str]) -> tuple[list[float], list[np.ndarray | None]]:
+    """Sentiment scores and embeddings for texts, sharing a forward pass where possible"""
+
+    if BACKEND == "transformer":
+        return calc_sentiment_and_embeddings(texts)
+
+    return calc_sentiment_scores(texts), [word_vector_embedding(text) for text in texts]
+
+
+def embed_text(text: str) -> np.ndarray | None:
+    """Embed a single text"""
+
+    return embed_texts([text])[0]
+
+
+def embed_texts(texts: list[str]) -> list[np.ndarray | None]:
+    """Embed many texts with the configured backend"""
+
+    if BACKEND == "transformer":
+        return calc_sentiment_and_embeddings(texts)[1]
+
+    return [word_vector_embedding(text) for text in texts]
+
+
+def word_vector_embedding(text: str) -> np.ndarray | None:
+    """Unit-length mean of the text's word vectors, or None if no words are known"""
+
+    from gensim.utils import simple_preprocess
+
+    vectors = get_word_vectors()
+    words = [word for word in simple_preprocess(text) if word in vectors.key_to_index]
+    if not words:
+        return None
+
+    mean = vectors[words].mean(axis=0)
+    norm = np.linalg.norm(mean)
+    if not norm:
+        return None
+
+    return (mean / norm).astype(np.float32)
+
+
+def similarity(a: np.ndarray | None, b: np.ndarray | None) -> float:
+    """Cosine similarity of two unit-length embeddings, clipped to [0, 1]"""
+
+    if a is None or b is None or len(a) != len(b):
+        return 0.0
+
+    return float(np.clip(np.dot(a, b), 0.0, 1.0))
+
+
+if __name__ == "__main__":
+
+    download_word_vectors()
@@ -48,20 +48,27 @@ interface Rewrite {
   text: string;
   timestamp: string;
   semantic_score: number;
-  sentiment_match: number;
-  semantic_match: number;
-  sentiment_score: number;
+  /* Scores are null until the rewrite is scored, and stay null if that fails */
+  sentiment_match: number | null;
+  semantic_match: number | null;
+  sentiment_score: number | null;
+  status: string;
 }
 
 interface RewriteReq {
   text: string;
   headline_id: string;
+  async?: boolean;
 }
 
 interface RewriteRes {
   rewrite: Rewrite;
 }
 
+interface JobRes {
+  job: { id: string; status: string };
+}
+
 interface ErrorRes {
   error: string;
 }
@@ -81,6 +88,11 @@ interface HeadlineRes {
   headline: Headline;
 }
 
+interface HeadlinesPage {
+  headlines: Headline[];
+  next_cursor: string | null;
+}
+
 /*
  * Main Form Functions
  */
@@ -94,9 +106,37 @@ async function rewriteFormHandler(
   const requestBody: RewriteReq = {
     text: text,
     headline_id: headlineId,
+    async: true,
   };
-  const rewrite = await sendRewrite(requestBody);
-  if (rewrite) showRewrite(rewrite.rewrite, rewriteList);
+  const job = await sendRewrite(requestBody);
+  if (job && "error" in job) {
+    showError(job.error);
+  } else if (job) {
+    const rewrite = await waitForRewrite(job.job.id);
+    if (rewrite) showRewrite(rewrite, rewriteList);
+  }
+}
+
+/* Polls before giving up on a pending rewrite, a little over a minute */
+const MAX_REWRITE_POLLS = 40;
+
+/* Poll a pending rewrite until the server has scored it */
+async function waitForRewrite(id: string): Promise<Rewrite | void> {
+  let delay = 250;
+  for (let poll = 0; poll < MAX_REWRITE_POLLS; poll++) {
+    const res = await getRewrite(id);
+    if (!res) return;
+    if ("error" in res) return showError(res.error);
+    if (res.rewrite.status === "complete") return res.rewrite;
+    if (res.rewrite.status === "failed") {
+      return showError("Your rewrite could not be scored.");
+    }
+    await new Promise((resolve) => setTimeout(resolve, delay));
+    delay = Math.min(delay * 2, 2000);
+  }
+  showError(
+    "Your rewrite is taking a while to score. It will be on your rewrites page when it is done."
+  );
 }
 
 /* Add rewrite to DOM */
@@ -112,8 +152,13 @@ function showRewrite(rewrite: Rewrite, container: HTMLUListElement): void {
 
   rewriteDiv.append(deleteButton);
   rewriteDiv.append(heading);
-  rewriteDiv.append(makeSentimentGraph(rewrite.sentiment_score));
-  rewriteDiv.append(makeDifferenceGraph(rewrite.sentiment_match));
+  if (rewrite.sentiment_score === null || rewrite.sentiment_match === null) {
+    /* Pending and failed rewrites come back from the history without scores */
+    rewriteDiv.append(makeStatusNote(rewrite.status));
+  } else {
+    rewriteDiv.append(makeSentimentGraph(rewrite.sentiment_score));
+    rewriteDiv.append(makeDifferenceGraph(rewrite.sentiment_match));
+  }
   container.style.display = "block";
   container.prepend(rewriteDiv);
 }
@@ -138,6 +183,15 @@ function makeDeleteButton(
   return button;
 }
 
+/* Shown in place of the graphs for a rewrite that has no scores */
+function makeStatusNote(status: string): HTMLSpanElement {
+  const note = document.createElement("span");
+  note.classList.add("rewrite-status");
+  note.innerText =
+    status === "failed" ? "Could not be scored" : "Still being scored";
+  return note;
+}
+
 function calculateScore(match: number): number {
   return Math.round(Math.abs(match) * 100);
 }
@@ -279,31 +333,62 @@ function removeIds(node: Element): void {
  * Rewrites Page: Functions for getting and displaying all of a user's old rewrites
  */
 
-/* Get all the user's old rewrites and add them to the DOM */
+/* Get the user's old rewrites a page at a time, loading more on scroll */
 async function showOldRewrites(): Promise<void> {
   const allHeadlinesContainer = document.querySelector(
     "#previous-rewrites-container"
   ) as HTMLDivElement;
-  const headlines = await getAllHeadlines();
-
-  if (headlines) {
-    allHeadlinesContainer.replaceChildren("");
-    headlines.forEach((headline) => {
-      const hContainer = document.createElement("div");
-      hContainer.classList.add("rewrite-container");
-      const link = document.createElement("a");
-      const hElement = document.createElement("h2");
-      void showHeadline(hElement, link, headline);
-      hContainer.append(link);
-
-      const rewritesList = document.createElement("ul");
+  /* Rewrites of one headline can be split across pages */
+  const rewriteLists = new Map<string, HTMLUListElement>();
+  const sentinel = document.createElement("div");
+  let cursor: string | null = null;
+  let loading = false;
+
+  async function loadPage(): Promise<void> {
+    if (loading) return;
+    loading = true;
+    const page = await getHeadlinesPage(cursor);
+    loading = false;
+    if (!page) return;
+
+    if (cursor === null) allHeadlinesContainer.replaceChildren("");
+    page.headlines.forEach((headline) => {
+      let rewritesList = rewriteLists.get(headline.id);
+      if (!rewritesList) {
+        const hContainer = document.createElement("div");
+        hContainer.classList.add("rewrite-container");
+        const link = document.createElement("a");
+        const hElement = document.createElement("h2");
+        void showHeadline(hElement, link, headline);
+        hContainer.append(link);
+
+        rewritesList = document.createElement("ul");
+        rewriteLists.set(headline.id, rewritesList);
+        hContainer.append(rewritesList);
+        allHeadlinesContainer.append(hContainer);
+      }
+      const list = rewritesList;
       (headline.rewrites as Rewrite[]).forEach((rewrite) => {
-        showRewrite(rewrite, rewritesList);
+        showRewrite(rewrite, list);
       });
-      hContainer.append(rewritesList);
-      allHeadlinesContainer.append(hContainer);
     });
+
+    cursor = page.next_cursor;
+    observer.unobserve(sentinel);
+    if (cursor === null) {
+      sentinel.remove();
+    } else {
+      /* Observing again reports straight away if the page did not fill the screen */
+      allHeadlinesContainer.after(sentinel);
+      observer.observe(sentinel);
+    }
   }
+
+  const observer = new IntersectionObserver((entries) => {
+    if (entries.some((entry) => entry.isIntersecting)) void loadPage();
+  });
+
+  await loadPage();
 }
 
 /*
@@ -361,24 +446,35 @@ function getHeadline(): Promise<Headline | void> {
 }
 
 /* API request to get sentiment analysis */
-function sendRewrite(data: RewriteReq): Promise<RewriteRes | void> {
+function sendRewrite(data: RewriteReq): Promise<JobRes | ErrorRes | void> {
   return fetch("/api/rewrites", {
     method: "POST",
     headers: { "Content-Type": "application/json" },
     body: JSON.stringify(data),
   })
     .then((p) => p.json())
-    .then((data: RewriteRes) => data)
+    .then((data: JobRes | ErrorRes) => data)
+    .catch((err: ErrorRes) => showError(err.error));
+}
+
+/* API request for a rewrite and the status of its scoring */
+function getRewrite(id: string): Promise<RewriteRes | ErrorRes | void> {
+  return fetch(`/api/rewrites/${id}`)
+    .then((res) => res.json())
+    .then((data: RewriteRes | ErrorRes) => data)
     .catch((err: ErrorRes) => showError(err.error));
 }
 
-/* API request for getting all of a user's headlines */
-function getAllHeadlines(): Promise<Headline[] | void> {
-  return fetch("/api/users/logged_in_user/rewrites", {
+/* API request for a page of the user's headlines and rewrites, newest first */
+function getHeadlinesPage(
+  cursor: string | null
+): Promise<HeadlinesPage | void> {
+  const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : "";
+  return fetch(`/api/users/logged_in_user/rewrites${query}`, {
     headers: { "Content-Type": "application/json" },
   })
     .then((data) => data.json())
-    .then((lines: Headline[]) => lines)
+    .then((page: HeadlinesPage) => page)
     .catch((err: ErrorRes) => showError(err.error));
 }
 
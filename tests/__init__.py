@@ -0,0 +1,6 @@
+import os
+
+# Tests use the instant lexicon backend and its hashed embeddings unless told otherwise,
+# e.g. SENTIMENT_BACKEND=flair SEMANTIC_BACKEND=word-vectors pytest
+os.environ.setdefault("SENTIMENT_BACKEND", "fake")
+os.environ.setdefault("SEMANTIC_BACKEND", "transformer")
@@ -1,6 +1,7 @@
 """Reused fixtures"""
 
 import pytest
+from sqlalchemy import event
 from server import create_app, db
 from datetime import date
 from flask import Flask
@@ -48,6 +49,20 @@ def user(client) -> User:
     return user
 
 
+@pytest.fixture
+def statements() -> list[str]:
+    """Collect the SQL statements run from now until the end of the test"""
+
+    executed = []
+
+    def record(connection, cursor, statement, *args):
+        executed.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", record)
+    yield executed
+    event.remove(db.engine, "before_cursor_execute", record)
+
+
 @pytest.fixture(autouse=True)
 def rollback_db() -> None:
     db.session.rollback()
@@ -0,0 +1,99 @@
+"""Test the sentiment backends"""
+
+import os
+from pathlib import Path
+
+import pytest
+
+import server.analysis
+from server.analysis import (
+    calc_sentiment_and_embeddings,
+    configure_threads,
+    get_backend,
+    predict_scores_locally,
+)
+from server.backends import SentimentBackend, load_backend
+from server.backends.lexicon import lexicon_score
+
+HEADLINES = Path(__file__).parent / "data" / "headlines.txt"
+
+# The model backends take a while to load, so only run them when asked for,
+# e.g. SENTIMENT_BACKEND=flair pytest
+requires_model = pytest.mark.skipif(
+    not os.environ["SENTIMENT_BACKEND"].startswith("flair"),
+    reason="Set SENTIMENT_BACKEND=flair to test the model backends",
+)
+
+
+@requires_model
+def test_quantized_backend_matches_fp32() -> None:
+    """Does the int8 model agree with the fp32 model on the stored headlines?"""
+
+    texts = HEADLINES.read_text().splitlines()
+    fp32 = load_backend("flair").predict(texts, 32)
+    int8 = load_backend("flair-quantized").predict(texts, 32)
+
+    same_sign = sum((a > 0) == (b > 0) for a, b in zip(fp32, int8))
+    mean_error = sum(abs(a - b) for a, b in zip(fp32, int8)) / len(texts)
+
+    assert same_sign / len(texts) >= 0.95
+    assert mean_error < 0.05
+
+
+@requires_model
+def test_batched_scores_match_single_scores() -> None:
+    """Does batching change any scores?"""
+
+    texts = HEADLINES.read_text().splitlines()[:8]
+    batched = predict_scores_locally(texts, batch_size=4)
+    single = [predict_scores_locally([text])[0] for text in texts]
+
+    assert batched == [pytest.approx(score, abs=1e-4) for score in single]
+
+
+def test_scores_and_embeddings_share_a_pass() -> None:
+    """Does the combined path give the same scores plus unit-length embeddings?"""
+
+    texts = HEADLINES.read_text().splitlines()[:8]
+    scores, embeddings = calc_sentiment_and_embeddings(texts)
+
+    assert scores == [pytest.approx(s, abs=1e-4) for s in predict_scores_locally(texts)]
+    assert len(embeddings) == len(texts)
+    assert all(abs(float((e**2).sum()) - 1) < 1e-4 for e in embeddings)
+
+
+def test_lexicon_backend() -> None:
+    """Does the fake backend score like Flair: signed, with confidence from 0.5 to 1?"""
+
+    assert lexicon_score("A great thing happened") > 0.5
+    assert lexicon_score("A terrible thing happened") < -0.5
+    assert lexicon_score("A thing happened") == 0.5
+    assert lexicon_score("Great, good, amazing news") <= 1.0
+
+
+def test_configure_threads_before_loading(monkeypatch) -> None:
+    """Is a thread budget kept until the backend loads, rather than loading it?"""
+
+    # The inference service shares the web containers' environment, socket included
+    monkeypatch.setattr(server.analysis, "INFERENCE_SOCKET", "/tmp/sentiment.sock")
+
+    class Backend(SentimentBackend):
+        threads = None
+
+        def configure_threads(self, threads: int) -> None:
+            self.threads = threads
+
+    loaded = []
+    monkeypatch.setattr(server.analysis, "_backend", None)
+    monkeypatch.setattr(server.analysis, "_threads", None)
+    monkeypatch.setattr(
+        server.analysis, "load_backend", lambda name: loaded.append(name) or Backend()
+    )
+
+    configure_threads(3)
+    assert loaded == []
+
+    assert get_backend().threads == 3
+    configure_threads(2)
+    assert get_backend().threads == 2
+    assert len(loaded) == 1
@@ -3,10 +3,31 @@
 from flask import request, session
 from flask.testing import FlaskClient
 from server import create_app
-from server.models import Headline, Rewrite, User
+from server import db
+from server.jobs import rescore_stale_rewrites
+from server.models import (
+    Headline,
+    IngestRun,
+    Rewrite,
+    User,
+    new_headline,
+    new_pending_rewrite,
+)
+from server.sampling import HeadlinePool
 import pytest
-
-from .fixtures import seed_database, set_config_variables, client, rollback_db, user
+import json
+import uuid
+import time
+from datetime import date, datetime, timedelta
+
+from .fixtures import (
+    seed_database,
+    set_config_variables,
+    client,
+    rollback_db,
+    statements,
+    user,
+)
 
 ##############################################################################
 # Rewrites endpoint
@@ -35,6 +56,27 @@ def test_submit_rewrite(client, user):
         # assert Rewrite.query.count() == 3
 
 
+def test_submit_rewrite_with_stale_session(client):
+    """Does a session whose user was deleted, e.g. by reseeding, get a new anonymous user?"""
+
+    with client:
+        with client.session_transaction() as session:
+            session["user_id"] = uuid.uuid4()
+            session["anonymous"] = False
+
+        headline = Headline.query.filter(
+            Headline.text == "A great thing happened"
+        ).one()
+        res = client.post(
+            "/api/rewrites",
+            json={"text": "Something happened again", "headline_id": headline.id},
+        )
+
+        assert res.status_code == 201
+        user = User.query.get(res.json["rewrite"]["user_id"])
+        assert user.anonymous
+
+
 def test_submit_rewrite_error_handling(client, user):
     """Are malformed post requests to /api/rewrites handled properly?"""
 
@@ -101,8 +143,61 @@ def test_get_all_headlines_for_user(client, user):
     with client:
         res = client.get(f"/api/users/{user.id}/rewrites")
         assert res.status_code == 200
-        assert len(res.json) == 1
-        assert len(res.json[0]["rewrites"]) == 3
+        assert len(res.json["headlines"]) == 1
+        assert len(res.json["headlines"][0]["rewrites"]) == 3
+        assert res.json["next_cursor"] is None
+
+
+def test_get_rewrites_page_by_page(client, user):
+    """Can a user's rewrites be read a page at a time, newest first?"""
+
+    with client:
+        seen = []
+        cursor = None
+        for _ in range(3):
+            query = {"limit": 1} | ({"cursor": cursor} if cursor else {})
+            res = client.get("/api/users/logged_in_user/rewrites", query_string=query)
+            assert res.status_code == 200
+            seen += [r["id"] for h in res.json["headlines"] for r in h["rewrites"]]
+            cursor = res.json["next_cursor"]
+
+        assert cursor is None
+        assert len(set(seen)) == 3
+        newest = (
+            Rewrite.query.filter(Rewrite.user_id == user.id)
+            .order_by(Rewrite.timestamp.desc(), Rewrite.id.desc())
+            .first()
+        )
+        assert seen[0] == str(newest.id)
+
+        res = client.get("/api/users/logged_in_user/rewrites?cursor=nonsense")
+        assert res.status_code == 400
+
+
+def test_stream_rewrites(client, user):
+    """Can a user's whole history be streamed as newline-delimited JSON?"""
+
+    with client:
+        res = client.get("/api/users/logged_in_user/rewrites?stream=true")
+        assert res.status_code == 200
+        assert res.mimetype == "application/x-ndjson"
+
+        lines = [json.loads(line) for line in res.data.splitlines()]
+        assert len(lines) == 3
+        assert all(len(line["rewrites"]) == 1 for line in lines)
+
+
+def test_get_all_headlines_for_user_queries(client, user, statements):
+    """Are a user's rewrites loaded in a constant number of queries?"""
+
+    with client:
+        statements.clear()
+        res = client.get(f"/api/users/{user.id}/rewrites")
+
+        assert res.status_code == 200
+        # The user, to add claims to the fixture's session, then the headlines with
+        # their rewrites and sources
+        assert len(statements) <= 2
 
 
 def test_cannot_get_rewrites_of_other_user(client, user):
@@ -115,6 +210,90 @@ def test_cannot_get_rewrites_of_other_user(client, user):
         assert res.json == {"error": "You do not have access to this resource."}
 
 
+def test_submit_rewrite_async(client, user):
+    """Is an async rewrite accepted as pending and scored in the background?"""
+
+    with client:
+        headline = Headline.query.filter(
+            Headline.text == "Another thing happened"
+        ).one()
+
+        res = client.post(
+            "/api/rewrites",
+            json={
+                "text": "Something eventually happened",
+                "headline_id": headline.id,
+                "async": True,
+            },
+        )
+
+        assert res.status_code == 202
+        assert res.json["job"]["status"] == "pending"
+        assert res.headers["Location"] == f"/api/rewrites/{res.json['job']['id']}"
+
+        for _ in range(100):
+            status = client.get(res.headers["Location"])
+            if status.json["rewrite"]["status"] != "pending":
+                break
+            time.sleep(0.1)
+
+        assert status.status_code == 200
+        assert status.json["rewrite"]["status"] == "complete"
+        assert status.json["rewrite"]["sentiment_score"] is not None
+
+
+def test_rescore_stale_rewrites(client, user):
+    """Are rewrites left pending by a lost worker scored, and fresh ones left alone?"""
+
+    with client:
+        headline = Headline.query.filter(
+            Headline.text == "Another thing happened"
+        ).one()
+        stale = new_pending_rewrite("A lost rewrite", headline, user.id)
+        stale.timestamp = datetime.now() - timedelta(hours=1)
+        fresh = new_pending_rewrite("A queued rewrite", headline, user.id)
+        db.session.add_all([stale, fresh])
+        db.session.commit()
+        ids = (stale.id, fresh.id)
+
+        assert rescore_stale_rewrites(client.application) == 1
+
+        stale, fresh = (Rewrite.query.get(rewrite_id) for rewrite_id in ids)
+        assert stale.status == "complete"
+        assert stale.sentiment_score is not None
+        assert fresh.status == "pending"
+
+        db.session.delete(stale)
+        db.session.delete(fresh)
+        db.session.commit()
+
+
+def test_get_ingest_runs(client, user):
+    """Can only admins see the ingest run ledger?"""
+
+    with client:
+        res = client.get("/api/admin/ingest-runs")
+        assert res.status_code == 403
+
+        user.admin = True
+        db.session.add(IngestRun(started_at=datetime.now(), feeds=2, new=5))
+        db.session.commit()
+
+        res = client.get("/api/admin/ingest-runs?limit=1")
+        assert res.status_code == 200
+        assert len(res.json["runs"]) == 1
+        assert res.json["runs"][0]["feeds"] == 2
+        assert res.json["runs"][0]["new"] == 5
+        assert res.json["runs"][0]["seconds"]["score"] == 0
+
+        res = client.get("/api/admin/ingest-runs?limit=-1")
+        assert res.status_code == 200
+        assert len(res.json["runs"]) == 1
+
+        user.admin = False
+        db.session.commit()
+
+
 def test_delete_rewrite(client, user):
     """Can a user delete a rewrite?"""
 
@@ -142,6 +321,23 @@ def test_get_random_headline(client):
         assert res.json["headline"]["text"] != None
 
 
+def test_random_headline_pool_refreshes_after_ingest(client):
+    """Does the random headline pool pick up headlines from a new ingest run?"""
+
+    with client:
+        pool = HeadlinePool(check_interval=0)
+        pool.choice()
+        size = len(pool)
+
+        source = Headline.query.first().source
+        db.session.add(new_headline("A fresh thing happened", date.today(), source.id))
+        db.session.add(IngestRun(started_at=datetime.now(), new=1))
+        db.session.commit()
+
+        assert json.loads(pool.choice())["headline"]["text"]
+        assert len(pool) == size + 1
+
+
 ##############################################################################
 # Views
 #
@@ -157,6 +353,20 @@ def test_index(client: FlaskClient, user: User):
         assert res.status_code == 200
 
 
+def test_page_views_without_queries(
+    client: FlaskClient, user: User, statements: list[str]
+):
+    """Once the session carries the user's claims, do page views skip the database?"""
+
+    with client:
+        client.get("/")
+        statements.clear()
+        responses = [client.get("/"), client.get("/about")]
+
+        assert all(res.status_code == 200 for res in responses)
+        assert statements == []
+
+
 def test_login_page(client: FlaskClient) -> None:
     """Can a user view the login page?"""
     with client:
@@ -0,0 +1,377 @@
+"""Test feed fetching and parsing, poll scheduling and the ingest pipeline"""
+
+import hashlib
+from datetime import datetime, timedelta, timezone
+from io import BytesIO
+import xml.etree.ElementTree as ET
+
+import pytest
+import requests
+from flask import Flask
+
+from server import feeds
+from server.feeds import (
+    FETCH_RETRIES,
+    MAX_POLL_INTERVAL,
+    MIN_POLL_INTERVAL,
+    Stage,
+    fetch_feed,
+    fetch_stage,
+    iter_feed_items,
+    make_session,
+    parse_stage,
+    poll_feeds,
+    run_pipeline,
+    schedule_next_poll,
+)
+from server.models import Feed
+
+##############################################################################
+# Feed parsing tests
+#
+
+RSS = b"""<?xml version="1.0"?>
+<rss version="2.0">
+  <channel>
+    <title>News</title>
+    <image><url>https://example.com/logo.png</url><title>News</title></image>
+    <item>
+      <title>First headline</title>
+      <link>https://example.com/1</link>
+      <pubDate>Mon, 03 Oct 2022 10:00:00 +0000</pubDate>
+    </item>
+    <item>
+      <title>Second headline</title>
+      <link>https://example.com/2</link>
+    </item>
+  </channel>
+</rss>"""
+
+ATOM = b"""<?xml version="1.0"?>
+<feed xmlns="http://www.w3.org/2005/Atom">
+  <title>News</title>
+  <entry>
+    <title>Atom headline</title>
+    <link rel="self" href="https://example.com/self"/>
+    <link href="https://example.com/atom"/>
+    <updated>2022-10-03T10:00:00+00:00</updated>
+  </entry>
+  <entry>
+    <title>Atom headline in UTC</title>
+    <link href="https://example.com/utc"/>
+    <updated>2022-10-03T10:00:00Z</updated>
+  </entry>
+</feed>"""
+
+
+def test_parse_rss():
+    """Are titles, links and RFC 822 dates read from RSS items, skipping the channel image?"""
+
+    items = list(iter_feed_items(BytesIO(RSS)))
+
+    assert items == [
+        {
+            "text": "First headline",
+            "url": "https://example.com/1",
+            "date": datetime(2022, 10, 3, 10, tzinfo=timezone.utc),
+        },
+        {"text": "Second headline", "url": "https://example.com/2", "date": None},
+    ]
+
+
+def test_parse_atom():
+    """Are Atom entries read with their alternate link, and ISO dates with or without Z?"""
+
+    items = list(iter_feed_items(BytesIO(ATOM)))
+
+    assert items == [
+        {
+            "text": "Atom headline",
+            "url": "https://example.com/atom",
+            "date": datetime(2022, 10, 3, 10, tzinfo=timezone.utc),
+        },
+        {
+            "text": "Atom headline in UTC",
+            "url": "https://example.com/utc",
+            "date": datetime(2022, 10, 3, 10, tzinfo=timezone.utc),
+        },
+    ]
+
+
+def test_parse_large_feed_incrementally():
+    """Are items yielded before the whole of a large feed is parsed?"""
+
+    body = (
+        b"<rss><channel>"
+        + b"".join(
+            b"<item><title>Headline %d</title><link>l</link></item>" % i
+            for i in range(5000)
+        )
+        + b"</channel></rss>"
+    )
+    items = iter_feed_items(BytesIO(body))
+
+    assert next(items)["text"] == "Headline 0"
+    assert sum(1 for _ in items) == 4999
+
+
+def test_parse_broken_feed():
+    """Does a truncated feed raise after its complete items, so ingest records it?"""
+
+    items = iter_feed_items(BytesIO(RSS[: RSS.index(b"<item>", RSS.index(b"</item>"))]))
+
+    assert next(items)["text"] == "First headline"
+    with pytest.raises(ET.ParseError):
+        next(items)
+
+
+##############################################################################
+# Fetching tests
+#
+
+
+class FakeResponse:
+    """Just enough of a streamed requests.Response for fetch_feed"""
+
+    def __init__(
+        self, status_code: int, body: bytes = b"", headers: dict | None = None
+    ):
+        self.status_code = status_code
+        self.body = body
+        self.headers = headers or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def raise_for_status(self) -> None:
+        if self.status_code >= 400:
+            raise requests.HTTPError(self.status_code)
+
+    def iter_content(self, size: int):
+        for start in range(0, len(self.body), size):
+            yield self.body[start : start + size]
+
+
+def fake_get(monkeypatch, responses: dict) -> list[dict]:
+    """Answer feeds.session.get from responses by URL, and return the headers sent"""
+
+    sent = []
+
+    def get(url, headers, **kwargs):
+        sent.append(headers)
+        response = responses[url]
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    monkeypatch.setattr(feeds.session, "get", get)
+    return sent
+
+
+def test_fetch_feed(monkeypatch):
+    """Is a changed feed returned with its body and the validators for the next poll?"""
+
+    sent = fake_get(
+        monkeypatch,
+        {"https://example.com/rss": FakeResponse(200, RSS, {"ETag": '"v2"'})},
+    )
+
+    result = fetch_feed("https://example.com/rss", {"etag": '"v1"'})
+
+    assert sent == [{"If-None-Match": '"v1"'}]
+    assert result["etag"] == '"v2"'
+    assert result["content_hash"] == hashlib.sha256(RSS).hexdigest()
+    assert result["body"].read() == RSS
+
+
+def test_fetch_unmodified_feed(monkeypatch):
+    """Does a 304 return no body, keeping the validators that were sent?"""
+
+    validators = {
+        "etag": '"v1"',
+        "last_modified": "Mon, 03 Oct 2022 10:00:00 GMT",
+        "content_hash": "abc",
+    }
+    sent = fake_get(monkeypatch, {"https://example.com/rss": FakeResponse(304)})
+
+    result = fetch_feed("https://example.com/rss", validators)
+
+    assert sent == [
+        {
+            "If-None-Match": '"v1"',
+            "If-Modified-Since": "Mon, 03 Oct 2022 10:00:00 GMT",
+        }
+    ]
+    assert result == {**validators, "body": None}
+
+
+def test_fetch_feed_with_same_hash(monkeypatch):
+    """Is a body that hashes the same as last time skipped, though the server sent it?"""
+
+    fake_get(monkeypatch, {"https://example.com/rss": FakeResponse(200, RSS)})
+
+    result = fetch_feed(
+        "https://example.com/rss", {"content_hash": hashlib.sha256(RSS).hexdigest()}
+    )
+
+    assert result["body"] is None
+    assert result["content_hash"] == hashlib.sha256(RSS).hexdigest()
+
+
+##############################################################################
+# Polling tests
+#
+
+
+def test_schedule_next_poll():
+    """Are busy feeds polled more often and quiet ones less, within the limits?"""
+
+    now = datetime(2022, 10, 3, 10)
+    busy = Feed(url="https://example.com/busy", poll_interval=3600)
+    quiet = Feed(url="https://example.com/quiet", poll_interval=3600)
+
+    schedule_next_poll(busy, 10, now)
+    schedule_next_poll(quiet, 0, now)
+
+    assert busy.poll_interval < 3600 < quiet.poll_interval
+    assert busy.next_poll_at == now + timedelta(seconds=busy.poll_interval)
+
+    for _ in range(50):
+        schedule_next_poll(busy, 10, now)
+        schedule_next_poll(quiet, 0, now)
+
+    assert busy.poll_interval == MIN_POLL_INTERVAL
+    assert quiet.poll_interval == MAX_POLL_INTERVAL
+
+
+def test_poll_feeds_saves_validators_without_errors(monkeypatch):
+    """Are validators only saved for feeds whose every headline was handled?"""
+
+    same = hashlib.sha256(b"same").hexdigest()
+    unchanged = Feed(url="https://example.com/same", parser="rss", content_hash=same)
+    failed = Feed(url="https://example.com/down", parser="rss", content_hash="old")
+    broken = Feed(url="https://example.com/broken", parser="rss", content_hash="old")
+    truncated = RSS[: RSS.index(b"</channel>") - 20]
+    fake_get(
+        monkeypatch,
+        {
+            unchanged.url: FakeResponse(200, b"same", {"ETag": '"v2"'}),
+            failed.url: FakeResponse(500),
+            broken.url: FakeResponse(200, truncated, {"ETag": '"v2"'}),
+        },
+    )
+    monkeypatch.setattr(feeds, "safe_commit", lambda obj: None)
+
+    with Flask(__name__).app_context():
+        run = poll_feeds([unchanged, failed, broken])
+
+    assert run.feeds == 3
+    assert run.errors == 2
+    assert unchanged.etag == '"v2"'
+    assert failed.etag is None and failed.content_hash == "old"
+    assert broken.etag is None and broken.content_hash == "old"
+
+
+##############################################################################
+# Pipeline tests
+#
+
+
+def test_run_pipeline():
+    """Does every item pass through each stage, with errors recorded on their jobs?"""
+
+    def split(job, text):
+        if text == "broken":
+            raise ValueError(text)
+        for word in text.split():
+            yield job, word
+
+    def collect(items):
+        for job, word in items:
+            job["words"].append(word)
+        return []
+
+    jobs = [
+        {"text": f"headline number {i}", "words": [], "errors": []} for i in range(20)
+    ]
+    jobs.append({"text": "broken", "words": [], "errors": []})
+    stats = run_pipeline(
+        [
+            Stage("split", split, threads=3),
+            Stage("collect", collect, batch=True, gather=4),
+        ],
+        [(job, job["text"]) for job in jobs],
+        Flask(__name__),
+    )
+
+    assert stats["split"]["items"] == 21
+    assert stats["split"]["errors"] == 1
+    assert stats["collect"]["items"] == 60
+    assert all(sorted(job["words"]) == sorted(job["text"].split()) for job in jobs[:-1])
+    assert jobs[-1]["errors"] == ["split: ValueError('broken')"]
+
+
+def test_batch_stage_gathering_one():
+    """Is a batch stage still passed a list when it gathers a single item?"""
+
+    jobs = [{"errors": []} for _ in range(3)]
+    batches = []
+    stats = run_pipeline(
+        [Stage("collect", lambda items: batches.append(items) or [], batch=True)],
+        [(job, "headline") for job in jobs],
+        Flask(__name__),
+    )
+
+    assert stats["collect"]["errors"] == 0
+    assert batches == [[(job, "headline")] for job in jobs]
+
+
+def test_fetch_errors_do_not_stall_pipeline(monkeypatch):
+    """Are timeouts and dropped connections errors of their own jobs, once retried?"""
+
+    adapter = make_session().get_adapter("https://example.com")
+    assert adapter.max_retries.total == FETCH_RETRIES
+
+    fake_get(
+        monkeypatch,
+        {
+            "https://example.com/slow": requests.Timeout("Read timed out"),
+            "https://example.com/gone": requests.ConnectionError("Connection refused"),
+            "https://example.com/rss": FakeResponse(200, RSS),
+        },
+    )
+    jobs = [
+        {"url": f"https://example.com/{path}", "validators": {}, "errors": []}
+        for path in ("slow", "gone", "rss", "slow", "gone")
+    ]
+    fetched = []
+    stats = run_pipeline(
+        [
+            Stage("fetch", fetch_stage, threads=2),
+            Stage("collect", lambda job, body: fetched.append(body.read()) or []),
+        ],
+        [(job, None) for job in jobs],
+        Flask(__name__),
+    )
+
+    assert fetched == [RSS]
+    assert stats["fetch"]["errors"] == 4
+    assert [len(job["errors"]) for job in jobs] == [1, 1, 0, 1, 1]
+    assert jobs[0]["errors"][0].startswith("fetch: ConnectionError")
+
+
+def test_pipeline_records_broken_feed():
+    """Is a truncated feed recorded as an error of its job, so ingest_runs counts it?"""
+
+    job = {"parser": "rss", "fetched": 0, "errors": []}
+    stats = run_pipeline(
+        [Stage("parse", parse_stage)],
+        [(job, BytesIO(RSS[: RSS.index(b"</channel>") - 20]))],
+        Flask(__name__),
+    )
+
+    assert stats["parse"]["errors"] == 1
+    assert job["errors"][0].startswith("parse: ParseError")
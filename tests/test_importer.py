@@ -0,0 +1,59 @@
+"""Test the bulk headline import"""
+
+import json
+
+from server.importer import import_headlines, read_checkpoint
+from server.models import Headline, Source
+
+from .fixtures import seed_database, set_config_variables, rollback_db
+
+ROWS = [
+    {"source": "Amazing News", "text": "A great thing happened", "date": "2022-10-03"},
+    {
+        "source": "Amazing News",
+        "text": "An archived thing happened",
+        "url": "a",
+        "date": "2021-05-01",
+    },
+    {"source": "Archive News", "text": "An old thing happened", "date": "2020-01-01"},
+    {"source": "Archive News", "text": "An old thing happened", "date": "2020-01-01"},
+    {"source": "Archive News", "text": "A forgotten thing happened"},
+    {"source": "Archive News", "text": "A misdated thing happened", "date": "Spring"},
+    {"source": "Archive News", "text": "  ", "date": "2020-01-01"},
+    {"text": "A sourceless thing happened", "date": "2020-01-01"},
+]
+
+
+def write_archive(path, rows) -> None:
+    with open(path, "a") as file:
+        for row in rows:
+            file.write(json.dumps(row) + "\n")
+
+
+def test_import_headlines(tmp_path) -> None:
+    """
+    Are new dated headlines imported, undated and invalid ones skipped and counted
+    apart from duplicates, and does a second run resume from the checkpoint?
+    """
+
+    archive = str(tmp_path / "headlines.jsonl")
+    write_archive(archive, ROWS)
+
+    stats = import_headlines(archive, workers=1, chunk_size=2)
+
+    assert stats["rows"] == 8
+    assert stats["new"] == 2
+    assert stats["duplicates"] == 2
+    assert stats["undated"] == 2
+    assert stats["invalid"] == 2
+    assert read_checkpoint(f"{archive}.checkpoint") == 8
+    source = Source.query.filter(Source.name == "Archive News").one()
+    assert Headline.query.filter(Headline.source_id == source.id).count() == 1
+
+    later = {"source": "Archive News", "text": "A later thing", "date": "2021-01-01"}
+    write_archive(archive, [later])
+    stats = import_headlines(archive, workers=1, chunk_size=2)
+
+    assert stats["skipped"] == 8
+    assert stats["new"] == 1
+    assert read_checkpoint(f"{archive}.checkpoint") == 9
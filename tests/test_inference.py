@@ -0,0 +1,111 @@
+"""Test the inference service and its client"""
+
+import asyncio
+import json
+import socket
+import threading
+
+import pytest
+
+from server.inference import (
+    InferenceClient,
+    InferenceError,
+    MicroBatcher,
+    start_server,
+)
+
+
+def start_service(path: str, predict, **kwargs) -> None:
+    """Serve predict on a Unix socket from a background thread"""
+
+    started = threading.Event()
+
+    async def serve() -> None:
+        batcher = MicroBatcher(predict, max_wait=0.05)
+        server = await start_server(path, batcher, **kwargs)
+        started.set()
+        async with server:
+            await asyncio.gather(server.serve_forever(), batcher.run())
+
+    threading.Thread(target=asyncio.run, args=(serve(),), daemon=True).start()
+    started.wait()
+
+
+def test_bad_request_does_not_fail_batch(tmp_path) -> None:
+    """Is a malformed request rejected alone, without failing the batch it would join?"""
+
+    def predict(texts):
+        return [(float(len(text)), None) for text in texts]
+
+    path = str(tmp_path / "sentiment.sock")
+    start_service(path, predict)
+    client = InferenceClient(path)
+    results = {}
+
+    def good() -> None:
+        results["good"] = client.predict_scores(["abc", "de"])
+
+    thread = threading.Thread(target=good)
+    thread.start()
+    with pytest.raises(InferenceError, match="list of strings"):
+        client.predict_scores([1, 2])
+    thread.join()
+
+    assert results["good"] == [3.0, 2.0]
+
+
+def predict_lengths(texts):
+    return [(float(len(text)), None) for text in texts]
+
+
+def test_long_request_is_scored(tmp_path) -> None:
+    """Are requests past asyncio's default 64 KiB line limit still answered?"""
+
+    path = str(tmp_path / "long.sock")
+    start_service(path, predict_lengths)
+    texts = [f"Headline number {i} about something that happened" for i in range(2000)]
+
+    scores = InferenceClient(path).predict_scores(texts)
+
+    assert len(json.dumps({"texts": texts})) > 2**16
+    assert scores == [float(len(text)) for text in texts]
+
+
+def test_oversized_request_gets_error(tmp_path) -> None:
+    """Is a request over the limit answered with an error, keeping the connection open?"""
+
+    path = str(tmp_path / "limit.sock")
+    start_service(path, predict_lengths, limit=2**16)
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.connect(path)
+    reader = connection.makefile("rb")
+
+    connection.sendall(json.dumps({"texts": ["x" * 2**17]}).encode("utf8") + b"\n")
+    assert "size limit" in json.loads(reader.readline())["error"]
+
+    connection.sendall(json.dumps({"texts": ["abc"]}).encode("utf8") + b"\n")
+    assert json.loads(reader.readline()) == {"scores": [3.0]}
+    connection.close()
+
+
+def test_client_does_not_resend_on_timeout(tmp_path) -> None:
+    """Does a slow service get each request once, rather than again after a timeout?"""
+
+    path = str(tmp_path / "slow.sock")
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen()
+    accepted = []
+
+    def accept() -> None:
+        while True:
+            connection, _ = listener.accept()
+            accepted.append(connection)
+
+    threading.Thread(target=accept, daemon=True).start()
+
+    with pytest.raises(TimeoutError):
+        InferenceClient(path, timeout=0.2).predict_scores(["A slow thing happened"])
+
+    assert len(accepted) == 1
+    listener.close()
@@ -0,0 +1,71 @@
+"""Test the ingest worker"""
+
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+
+from server import db
+from server.feeds import poll_due_feeds, write_stage
+from server.ingest import LOCK_KEY, leader_lock
+from server.models import (
+    Feed,
+    Headline,
+    IngestRun,
+    Source,
+    find_new_items,
+    headline_rows,
+)
+
+from .fixtures import seed_database, set_config_variables, rollback_db
+
+
+def test_leader_lock() -> None:
+    """Is there one leader, and does it notice when its lock's connection is lost?"""
+
+    with leader_lock() as held:
+        assert held()
+        with leader_lock(wait=False) as standby:
+            assert standby is None
+
+        # Postgres ends the leader's session, as it would on a network failure
+        with db.engine.connect() as connection:
+            connection.execute(
+                text(
+                    "SELECT pg_terminate_backend(pid) FROM pg_locks"
+                    " WHERE locktype = 'advisory' AND objid = :key"
+                ),
+                {"key": LOCK_KEY},
+            )
+        assert not held()
+
+    with leader_lock(wait=False) as held:
+        assert held()
+
+
+def test_write_stage_recovers_from_error() -> None:
+    """Does a failed write leave the thread's session able to write the next batch?"""
+
+    source = Source.query.first()
+    job = {"errors": []}
+    items = find_new_items([{"text": "A write that follows a failure"}], source.id)
+
+    with pytest.raises(IntegrityError):
+        list(write_stage(job, headline_rows(items, uuid.uuid4(), [0.5], [None])))
+    list(write_stage(job, headline_rows(items, source.id, [0.5], [None])))
+
+    assert job["new"] == 1
+    assert Headline.query.filter_by(text="A write that follows a failure").count() == 1
+
+
+def test_poll_without_due_feeds() -> None:
+    """Does a tick with no feeds due leave the ingest_runs ledger alone?"""
+
+    now = datetime.now()
+    Feed.query.update({Feed.next_poll_at: now + timedelta(hours=1)})
+    runs = IngestRun.query.count()
+
+    assert poll_due_feeds(now) is None
+    assert IngestRun.query.count() == runs
@@ -16,11 +16,23 @@ from server.models import (
     new_rewrite,
     new_user,
     new_headline,
+    find_new_items,
+    headline_rows,
+    write_headlines,
     authenticate_user,
     safe_delete,
     serialize,
+    headline_json,
+    rewrite_history,
+    rewrite_json,
 )
 from server import create_app
+import server.analysis
+from server.analysis import (
+    calc_sentiment_and_embeddings,
+    calc_sentiment_score,
+    score_cache,
+)
 from .fixtures import set_config_variables, seed_database
 
 ##############################################################################
@@ -69,6 +81,34 @@ def test_new_headline(client: FlaskClient, add_headline: Headline) -> None:
     assert Headline.query.count() == 3
 
 
+def test_write_new_headlines() -> None:
+    """Are only headlines the source does not have yet found and inserted?"""
+
+    source = Source.query.filter(Source.name == "Amazing News").one()
+    items = [
+        {"text": "A great thing happened", "date": date.today()},
+        {"text": "A brand new thing happened", "date": date.today()},
+        {"text": "A brand new thing happened", "date": date.today()},
+    ]
+
+    new_items = find_new_items(items, source.id)
+    assert [item["text"] for item in new_items.values()] == [
+        "A brand new thing happened"
+    ]
+
+    rows = headline_rows(new_items, source.id, [0.5], [None])
+    assert write_headlines(rows) == 1
+    # A concurrent ingest that found the same items inserts nothing
+    assert write_headlines(headline_rows(new_items, source.id, [0.5], [None])) == 0
+    db.session.commit()
+
+    assert find_new_items(items, source.id) == {}
+    assert (
+        Headline.query.filter(Headline.text == "A brand new thing happened").count()
+        == 1
+    )
+
+
 ##############################################################################
 # Rewrite model tests
 #
@@ -79,7 +119,7 @@ def test_new_rewrite(add_rewrite: Rewrite) -> None:
 
     r = add_rewrite
     assert r.text == "A good thing happened"
-    assert r.semantic_match == 1.0
+    assert r.semantic_match > 0.5 and r.semantic_match <= 1.0
     assert r.sentiment_score <= 1.0 and r.sentiment_score > 0
     assert r.user.username == "test_user"
     assert r.headline.text == "A great thing happened"
@@ -95,11 +135,64 @@ def test_delete_rewrite(add_rewrite: Rewrite) -> None:
     assert Rewrite.query.count() == current_rewrites - 1
 
 
+##############################################################################
+# Sentiment cache
+#
+
+
+def test_sentiment_cache() -> None:
+    """Are repeated texts scored from the cache instead of the model?"""
+
+    score_cache.clear()
+    first = calc_sentiment_score("A cached thing happened")
+    second = calc_sentiment_score("A  cached thing   happened ")
+    assert first == second
+    assert score_cache.stats()["hits"] == 1
+
+    # The shared tier should answer once the in-process tier is empty
+    score_cache.clear()
+    assert calc_sentiment_score("A cached thing happened") == first
+    assert score_cache.stats()["store_hits"] == 1
+    assert score_cache.stats()["misses"] == 0
+
+
+def test_embedding_cache(monkeypatch) -> None:
+    """Are repeated texts embedded from the cache, in either tier, without the model?"""
+
+    score_cache.clear()
+    # Scored alone first, so the embedding has to be added to the cached score
+    calc_sentiment_score("An embedded thing happened")
+    [score], [embedding] = calc_sentiment_and_embeddings(["An embedded thing happened"])
+
+    passes = []
+    monkeypatch.setattr(
+        server.analysis,
+        "predict_with_embeddings_locally",
+        lambda texts, batch_size=None: passes.append(texts),
+    )
+    again = calc_sentiment_and_embeddings(["An  embedded thing happened"])
+    score_cache.clear()
+    stored = calc_sentiment_and_embeddings(["An embedded thing happened"])
+
+    assert passes == []
+    for scores, embeddings in (again, stored):
+        assert scores == [score]
+        assert embeddings[0] == pytest.approx(embedding)
+
+
 ##############################################################################
 # Serialize
 #
 
+# The expected scores are the lexicon backend's, which the tests use unless told otherwise
+requires_lexicon = pytest.mark.skipif(
+    os.environ["SENTIMENT_BACKEND"] != "fake"
+    or os.environ["SEMANTIC_BACKEND"] != "transformer",
+    reason="Expected scores are from the lexicon backend",
+)
+
 
+@requires_lexicon
 def test_serialize_headline() -> None:
     """
     Are rewrites serialized properly?
@@ -117,42 +210,46 @@ def test_serialize_headline() -> None:
         "url": "",
         "date": date.today(),
         "text": "A great thing happened",
-        "sentiment_score": 0.990334689617157,
+        "sentiment_score": pytest.approx(0.8807971),
         "rewrites": [
             {
                 "id": 999,
                 "headline_id": 999,
-                "semantic_match": 1.0,
-                "sentiment_match": -1.6764936447143555,
-                "sentiment_score": -0.6861589550971985,
+                "semantic_match": pytest.approx(0.5),
+                "sentiment_match": pytest.approx(-0.3807971),
+                "sentiment_score": pytest.approx(0.5),
                 "text": "An ok thing happened",
                 "user_id": 999,
                 "timestamp": date.today(),
+                "status": "complete",
             },
             {
                 "id": 999,
                 "headline_id": 999,
-                "semantic_match": 1.0,
-                "sentiment_match": -0.023634910583496094,
-                "sentiment_score": 0.9666997790336609,
+                "semantic_match": pytest.approx(0.5),
+                "sentiment_match": pytest.approx(-0.1497385),
+                "sentiment_score": pytest.approx(0.7310586),
                 "text": "An interesting thing happened",
                 "user_id": 999,
                 "timestamp": date.today(),
+                "status": "complete",
             },
             {
                 "id": 999,
                 "headline_id": 999,
-                "semantic_match": 1.0,
-                "sentiment_match": -0.0008274316787719727,
-                "sentiment_score": 0.989507257938385,
+                "semantic_match": pytest.approx(0.75),
+                "sentiment_match": pytest.approx(0.0, abs=1e-6),
+                "sentiment_score": pytest.approx(0.8807971),
                 "text": "A good thing happened",
                 "user_id": 999,
                 "timestamp": date.today(),
+                "status": "complete",
             },
         ],
     }
 
 
+@requires_lexicon
 def test_serialize_with_other_user() -> None:
     """Are rewrites serialized properly?"""
 
@@ -167,11 +264,24 @@ def test_serialize_with_other_user() -> None:
         "url": "",
         "date": date.today(),
         "text": "A great thing happened",
-        "sentiment_score": 0.990334689617157,
+        "sentiment_score": pytest.approx(0.8807971),
         "rewrites": [],
     }
 
 
+def test_column_projection_matches_serialize() -> None:
+    """Do rows of projected columns give the same JSON as serialize?"""
+
+    user = User.query.filter(User.username == "test_user").one()
+    rows = rewrite_history(user.id).all()
+    assert rows
+
+    for row in rows:
+        rewrite = Rewrite.query.get(row.id)
+        assert rewrite_json(row) == serialize(rewrite)
+        assert headline_json(row, "headline__") == serialize(rewrite.headline)
+
+
 ##############################################################################
 # Fixtures and helpers
 #